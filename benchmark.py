@@ -0,0 +1,574 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from functools import partial
+from collections import Counter
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import *
+from mtedx_utils import (
+    SPLITS,
+    prepare_mtedx_avsr_manifests,
+    merge_mtedx_avsr_manifests,
+)
+from shard_utils import get_shard_idx, get_shard_filepath
+from download_utils import DownloadScheduler, HttpDownloader
+from pack_utils import ShardReader, pack_split, is_clip_location
+from clip_store_utils import ClipStore
+from resource_utils import ResourceGovernor
+
+
+def crop_patch_reference(
+    video_frames,
+    num_frames,
+    metadata,
+    mean_face_metadata,
+    std_size=(256, 256),
+    window_margin=12,
+    start_idx=48,
+    stop_idx=68,
+    crop_height=96,
+    crop_width=96,
+):
+    """Per-frame skimage implementation `crop_patch` is checked against"""
+    stablePntsIDs = [33, 36, 39, 42, 45]
+    margin = min(num_frames, window_margin)
+    q_frame, q_metadata = deque(), deque()
+    sequence = []
+    for frame_idx, frame in enumerate(video_frames):
+        if frame_idx >= len(metadata):
+            break
+        q_metadata.append(metadata[frame_idx])
+        q_frame.append(frame)
+        if len(q_frame) == margin:
+            smoothed_metadata = np.mean(q_metadata, axis=0)
+            cur_metadata = q_metadata.popleft()
+            cur_frame = q_frame.popleft()
+            trans_frame, trans = warp_img(
+                smoothed_metadata[stablePntsIDs, :],
+                mean_face_metadata[stablePntsIDs, :],
+                cur_frame,
+                std_size,
+            )
+            trans_metadata = trans(cur_metadata)
+            sequence.append(
+                cut_patch(
+                    trans_frame,
+                    trans_metadata[start_idx:stop_idx],
+                    crop_height // 2,
+                    crop_width // 2,
+                )
+            )
+    while q_frame:
+        cur_frame = q_frame.popleft()
+        trans_frame = apply_transform(trans, cur_frame, std_size)
+        trans_metadata = trans(q_metadata.popleft())
+        sequence.append(
+            cut_patch(
+                trans_frame,
+                trans_metadata[start_idx:stop_idx],
+                crop_height // 2,
+                crop_width // 2,
+            )
+        )
+    return sequence
+
+
+def create_synthetic_segment(mean_face_metadata, num_frames, height, width, seed=0):
+    """Creates smooth random frames with a moving face placed on them"""
+    rng = np.random.default_rng(seed)
+    background = cv2.resize(
+        rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8),
+        (width, height),
+        interpolation=cv2.INTER_CUBIC,
+    )
+    frames, metadata = [], []
+    for i in range(num_frames):
+        frames.append(np.roll(background, shift=i, axis=1))
+        angle = np.deg2rad(5 * np.sin(i / 10))
+        rotation = np.array(
+            [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+        )
+        center = np.array([width / 2 + 20 * np.sin(i / 7), height / 2])
+        face = (mean_face_metadata - mean_face_metadata.mean(axis=0)) @ rotation.T
+        metadata.append(1.5 * face + center + rng.normal(0, 1, face.shape))
+    return frames, metadata
+
+
+def benchmark_crop(args):
+    cv2.setNumThreads(1)  # report per-core throughput
+    mean_face_metadata = load_meanface_metadata(args.metadata_path)
+    frames, metadata = create_synthetic_segment(
+        mean_face_metadata, args.num_frames, args.height, args.width
+    )
+    results = {}
+    for name, crop_fn in [
+        ("skimage (per-frame)", crop_patch_reference),
+        ("batched", crop_patch),
+    ]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            results[name] = crop_fn(
+                iter(frames), len(frames), metadata, mean_face_metadata
+            )
+        elapsed = time.perf_counter() - start
+        fps = args.repeat * len(frames) / elapsed
+        print(f"{name:>20}: {fps:8.1f} frames/sec/core")
+    reference, batched = (np.stack(seq).astype(int) for seq in results.values())
+    diff = np.abs(reference - batched)
+    print(
+        f"{'abs. pixel diff':>20}: mean={diff.mean():.3f}, "
+        + f"p99={np.percentile(diff, 99):.0f}, max={diff.max()}"
+    )
+
+
+def benchmark_probe(args):
+    audio_files = sorted(args.data_path.rglob("*.wav"))[: args.num_files]
+    video_files = sorted(args.data_path.rglob("*.mp4"))[: args.num_files]
+    for desc, files, header_fn, subprocess_fn in [
+        (
+            "audio samples",
+            audio_files,
+            get_audio_samples,
+            lambda f: int(get_audio_duration(f) * 16_000),
+        ),
+        (
+            "video frames",
+            video_files,
+            get_video_frames,
+            lambda f: int(get_video_duration(f) * 25),
+        ),
+    ]:
+        if not files:
+            continue
+        timings, values = {}, {}
+        for name, probe_fn in [("header", header_fn), ("subprocess", subprocess_fn)]:
+            start = time.perf_counter()
+            values[name] = [probe_fn(f) for f in files]
+            timings[name] = len(files) / (time.perf_counter() - start)
+            print(f"{desc:>14} ({name:>10}): {timings[name]:10.1f} files/sec")
+        mismatches = sum(a != b for a, b in zip(*values.values()))
+        print(
+            f"{desc:>14}: {timings['header'] / timings['subprocess']:.1f}x faster, "
+            + f"{mismatches}/{len(files)} files differ"
+        )
+
+
+def create_synthetic_video(out_filepath, fps, duration, gop_size, video_delay=0):
+    """Encodes a test pattern, optionally starting after the audio stream"""
+    video = ffmpeg.input(
+        f"testsrc2=size=320x240:rate={fps}",
+        f="lavfi",
+        t=duration,
+        itsoffset=video_delay,
+    )
+    audio = ffmpeg.input("sine=frequency=440", f="lavfi", t=duration)
+    ffmpeg.output(
+        video,
+        audio,
+        str(out_filepath),
+        vcodec="libx264",
+        g=gop_size,
+        pix_fmt="yuv420p",
+    ).run(overwrite_output=True, quiet=True)
+
+
+def benchmark_seek(args):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fps, video_delay in [
+            (25, 0),
+            (30, 0),
+            ("30000/1001", 0),
+            (50, 0),
+            (30, 0.3),
+        ]:
+            video_filepath = Path(tmp_dir) / "video.mp4"
+            create_synthetic_video(
+                video_filepath, fps, args.duration, args.gop_size, video_delay
+            )
+            num_frames = len(list(split_video_to_frames(video_filepath)))
+            timings = {"decode from start": 0.0, "seek": 0.0}
+            mismatches = 0
+            for _ in range(args.num_segments):
+                fstart = int(rng.integers(0, num_frames - 1))
+                fend = min(num_frames + 5, fstart + int(rng.integers(1, 250)))
+                frames = {}
+                for name, preroll_frames in [
+                    ("decode from start", fstart),  # no seeking
+                    ("seek", 25),
+                ]:
+                    start = time.perf_counter()
+                    frames[name] = list(
+                        split_video_to_frames(
+                            video_filepath, fstart, fend, preroll_frames=preroll_frames
+                        )
+                    )
+                    timings[name] += time.perf_counter() - start
+                reference, seeked = frames.values()
+                if len(reference) != len(seeked) or any(
+                    not np.array_equal(a, b) for a, b in zip(reference, seeked)
+                ):
+                    mismatches += 1
+            print(
+                f"fps={fps!s:>10}, video delay={video_delay}s: "
+                + ", ".join(
+                    f"{name}={elapsed / args.num_segments * 1000:.0f}ms/segment"
+                    for name, elapsed in timings.items()
+                )
+                + f", {mismatches}/{args.num_segments} segments differ"
+            )
+
+
+def normalize_text_reference(text):
+    """`normalize_text()` before its regex & table were precompiled"""
+    PUNCS = "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~؟؛,’‘×÷"
+    # remove sound-effect description
+    text = re.sub(r"\([^)]*\)", "", text)
+    # remove punctuations
+    text = text.translate(str.maketrans("", "", PUNCS))
+    # normalize case
+    text = text.lower()
+    return text.strip()
+
+
+def split_sents_reference(text):
+    """`split_sents()` with the original end-of-sentence regex"""
+    SENT_END_REGEX = re.compile(
+        r"(?<=(?<!Mr)(?<!Mrs)(?<!Ms)(?<!Dr)(?<!Jr)[.!,?؟،])\s{1,2}"
+    )  # src: https://ideone.com/25TUP2
+    return SENT_END_REGEX.split(text)
+
+
+def create_synthetic_texts(num_texts, seed=0):
+    """Sentences with sound effects, abbreviations & non-English punctuation"""
+    rng = np.random.default_rng(seed)
+    words = [
+        "So", "we", "went", "(Laughter)", "Mr.", "Mrs.", "Dr.", "Smith.", "it's",
+        "ÉCOLE", "¿qué?", "yes!", "no,", "well...", "\"quote\"", "(Applause",
+        "hmm)", "لماذا؟", "نعم،", "x×y", "‘so’", "end.", "İstanbul", "50%",
+    ]
+    return [
+        "  ".join(rng.choice(words, rng.integers(1, 30)))
+        if idx % 7 == 0
+        else " ".join(rng.choice(words, rng.integers(1, 30)))
+        for idx in range(num_texts)
+    ]
+
+
+def benchmark_text(args):
+    if args.text_path:
+        texts = list(islice(read_txt_file(args.text_path), args.num_texts))
+    else:
+        texts = create_synthetic_texts(args.num_texts)
+    results = {}
+    for name, normalize_fn in [
+        ("reference", lambda t: [normalize_text_reference(x) for x in t]),
+        ("compiled", lambda t: [normalize_text(x) for x in t]),
+        ("batch", normalize_texts),
+        (
+            f"batch x{args.num_workers}",
+            lambda t: normalize_texts(
+                t, ResourceGovernor(args.num_workers), args.chunk_size
+            ),
+        ),
+    ]:
+        start = time.perf_counter()
+        results[name] = normalize_fn(texts)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20}: {len(texts) / elapsed:10.0f} texts/sec")
+    reference = results.pop("reference")
+    for name, normalized in results.items():
+        mismatches = sum(a != b for a, b in zip(reference, normalized))
+        assert len(normalized) == len(reference)
+        print(f"{name:>20}: {mismatches}/{len(texts)} texts differ")
+    for name, split_fn in [
+        ("split (reference)", split_sents_reference),
+        ("split", split_sents),
+    ]:
+        start = time.perf_counter()
+        results[name] = [split_fn(text) for text in texts]
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20}: {len(texts) / elapsed:10.0f} texts/sec")
+    mismatches = sum(
+        a != b for a, b in zip(results["split (reference)"], results["split"])
+    )
+    print(f"{'split':>20}: {mismatches}/{len(texts)} texts differ")
+
+
+def read_loose_sample(row, label):
+    with open(row["audio"], "rb") as fin:
+        audio = fin.read()
+    if is_clip_location(row["video"]):
+        video = np.array(ClipStore.load_clip(row["video"]))
+    else:
+        with open(row["video"], "rb") as fin:
+            video = fin.read()
+    return {"id": row["id"], "audio": audio, "video": video, "label": label}
+
+
+def benchmark_shards(args):
+    manifest_filepath = args.data_path / f"{args.split}.tsv"
+    df = read_av_manifest(manifest_filepath)
+    label_filepath = args.data_path / f"{args.split}.{args.label_ext}"
+    df["label"] = list(read_txt_file(label_filepath))
+    df = df[(df["video_frames"] >= 0) & (df["audio_samples"] >= 0)]
+    df = df.sample(n=min(args.num_samples, len(df)), random_state=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # pack the samples first, so both layouts read the same data
+        subset_filepath = Path(tmp_dir) / "subset" / manifest_filepath.name
+        subset_filepath.parent.mkdir()
+        write_av_manifest(df.drop(columns="label"), subset_filepath)
+        write_txt_file(df["label"].tolist(), subset_filepath.with_suffix(".label"))
+        pack_split(
+            subset_filepath,
+            subset_filepath.with_suffix(".label"),
+            Path(tmp_dir) / "packed",
+            ResourceGovernor(io_workers=1),
+            args.samples_per_shard,
+        )
+        reader = ShardReader(Path(tmp_dir) / "packed" / f"{args.split}.json")
+        # loose files are read in random order, like fairseq does
+        loose_samples = (
+            read_loose_sample(row, row["label"]) for row in df.to_dict("records")
+        )
+        for name, samples in [("loose files", loose_samples), ("shards", reader)]:
+            start = time.perf_counter()
+            num_samples = num_bytes = 0
+            for sample in samples:
+                num_samples += 1
+                num_bytes += len(sample["audio"]) + len(sample["video"])
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>11}: {num_samples / elapsed:.0f} samples/sec, "
+                + f"{num_bytes / elapsed / 1e6:.1f} MB/s"
+            )
+    print(
+        "NOTE: files read earlier may be served from the page cache, "
+        + "drop it or use data larger than the RAM for storage-bound numbers."
+    )
+
+
+def check_empty_shard(args):
+    """
+    Writes the mTEDx AVSR manifests of a talk with `num_shards` shards, so
+    all but one shard have no fileids, and merges them.
+    """
+    governor = ResourceGovernor(io_workers=1)
+    talk_id, lang = "talk", "es"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mtedx_path, muavic_path = Path(tmp_dir) / "mtedx", Path(tmp_dir) / "muavic"
+        for split in SPLITS:
+            txt_path = mtedx_path / f"{lang}-{lang}" / "data" / split / "txt"
+            txt_path.mkdir(parents=True)
+            write_txt_file([f"{talk_id}_0 {talk_id} 0.00 1.00"], txt_path / "segments")
+            write_txt_file(["hola"], txt_path / f"{split}.{lang}")
+        not_found_filepath = mtedx_path / "not_found_videos.txt"
+        for shard_idx in range(args.num_shards):
+            shard = (shard_idx, args.num_shards)
+            get_shard_filepath(not_found_filepath, shard).parent.mkdir(exist_ok=True)
+            get_shard_filepath(not_found_filepath, shard).touch()
+            prepare_mtedx_avsr_manifests(
+                mtedx_path, lang, muavic_path, governor, shard=shard
+            )
+            num_rows = len(
+                read_av_manifest(
+                    get_shard_filepath(muavic_path / lang / "train.tsv", shard)
+                )
+            )
+            is_talk_shard = get_shard_idx(talk_id, args.num_shards) == shard_idx
+            assert num_rows == int(is_talk_shard), f"shard {shard}: {num_rows} rows"
+        merge_mtedx_avsr_manifests(mtedx_path, lang, muavic_path, args.num_shards)
+        for split in SPLITS:
+            df = read_av_manifest(muavic_path / lang / f"{split}.tsv")
+            assert df["id"].tolist() == [f"{talk_id}/{talk_id}_0"], df
+    print(f"{args.num_shards - 1}/{args.num_shards} empty shards written & merged")
+
+
+class StandInVideoHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the videos of `server.directory`, except for `flaky` (the first
+    `server.num_flaky` requests fail with 503) and `broken` (always 500).
+    """
+
+    def do_GET(self):
+        self.server.requests[self.path] += 1
+        if self.path == "/broken.mp4" or (
+            self.path == "/flaky.mp4"
+            and self.server.requests[self.path] <= self.server.num_flaky
+        ):
+            self.send_error(503 if "flaky" in self.path else 500)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class NoOutputDownloader(HttpDownloader):
+    """Returns without writing `nofile`, like a downloader that lost its output"""
+
+    def download(self, video_id, out_filepath, *args, **kwargs):
+        if video_id != "nofile":
+            super().download(video_id, out_filepath, *args, **kwargs)
+
+
+def check_download(args):
+    video_size = int(args.video_mb * 1e6)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        serve_path, out_path = Path(tmp_dir) / "serve", Path(tmp_dir) / "out"
+        serve_path.mkdir()
+        out_path.mkdir()
+        for video_id in ["ok", "flaky", "nofile"]:
+            (serve_path / f"{video_id}.mp4").write_bytes(os.urandom(video_size))
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            partial(StandInVideoHandler, directory=str(serve_path)),
+        )
+        server.requests, server.num_flaky = Counter(), 2
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            scheduler = DownloadScheduler(
+                NoOutputDownloader(
+                    f"http://127.0.0.1:{server.server_port}/{{video_id}}.mp4"
+                ),
+                Ledger(Path(tmp_dir) / "ledger.db"),
+                max_concurrency=args.max_concurrency,
+                max_retries=3,
+                backoff_sec=0.01,
+                max_bandwidth=args.max_bandwidth_mb * 1e6,
+            )
+            video_ids = ["ok", "flaky", "gone", "broken", "nofile"]
+            start = time.perf_counter()
+            statuses = scheduler.run(video_ids, out_path, "check_download")
+            elapsed = time.perf_counter() - start
+        finally:
+            server.shutdown()
+        expected = {
+            "ok": Ledger.DONE,
+            "flaky": Ledger.DONE,  # after `num_flaky` retries
+            "gone": "not_found",
+            "broken": "failed",  # after `max_retries` retries
+            "nofile": "failed",  # no output file
+        }
+        assert statuses == expected, statuses
+        assert server.requests["/flaky.mp4"] == server.num_flaky + 1
+        assert server.requests["/broken.mp4"] == scheduler.max_retries + 1
+        for video_id in ["ok", "flaky"]:
+            assert (out_path / f"{video_id}.mp4").read_bytes() == (
+                serve_path / f"{video_id}.mp4"
+            ).read_bytes()
+        # each concurrent download gets its share of the bandwidth
+        min_elapsed = video_size / scheduler.rate_limit
+        assert elapsed >= 0.9 * min_elapsed, f"{elapsed:.2f}s < {min_elapsed:.2f}s"
+        # finished & not-found videos are skipped in later runs
+        server.requests.clear()
+        assert scheduler.run(["ok", "gone"], out_path, "check_download") == {
+            "ok": Ledger.DONE,
+            "gone": "not_found",
+        }
+        assert not server.requests
+    print(f"statuses: {statuses}")
+    print(f"{elapsed:.2f}s (>= {min_elapsed:.2f}s with the bandwidth limit)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    crop_parser = subparsers.add_parser(
+        "crop", help="Mouth-ROI cropping throughput & equivalence."
+    )
+    crop_parser.add_argument(
+        "--metadata-path",
+        required=True,
+        type=Path,
+        help="Directory containing (or to download) the mean-face metadata.",
+    )
+    crop_parser.add_argument("--num-frames", type=int, default=250)
+    crop_parser.add_argument("--height", type=int, default=720)
+    crop_parser.add_argument("--width", type=int, default=1280)
+    crop_parser.add_argument("--repeat", type=int, default=3)
+    crop_parser.set_defaults(func=benchmark_crop)
+
+    probe_parser = subparsers.add_parser(
+        "probe", help="Header-only vs. subprocess audio/video length probing."
+    )
+    probe_parser.add_argument(
+        "--data-path",
+        required=True,
+        type=Path,
+        help="Directory to look for `.wav` & `.mp4` files in (recursively).",
+    )
+    probe_parser.add_argument("--num-files", type=int, default=500)
+    probe_parser.set_defaults(func=benchmark_probe)
+
+    seek_parser = subparsers.add_parser(
+        "seek",
+        help="Segment reads with input seeking vs. decoding from the start, "
+        + "on synthetic videos (frames must be identical).",
+    )
+    seek_parser.add_argument("--duration", type=float, default=120)
+    seek_parser.add_argument("--gop-size", type=int, default=250)
+    seek_parser.add_argument("--num-segments", type=int, default=20)
+    seek_parser.set_defaults(func=benchmark_seek)
+
+    shards_parser = subparsers.add_parser(
+        "shards",
+        help="Samples/sec of packed training shards vs. loose audio/video files.",
+    )
+    shards_parser.add_argument(
+        "--data-path",
+        required=True,
+        type=Path,
+        help="Directory of the `{split}.tsv` manifests, e.g. `${ROOT}/muavic/es`.",
+    )
+    shards_parser.add_argument("--label-ext", required=True)
+    shards_parser.add_argument("--split", default="train")
+    shards_parser.add_argument("--num-samples", type=int, default=2000)
+    shards_parser.add_argument("--samples-per-shard", type=int, default=500)
+    shards_parser.set_defaults(func=benchmark_shards)
+
+    text_parser = subparsers.add_parser(
+        "text",
+        help="Text normalization & sentence splitting throughput, compared "
+        + "with the original implementations (outputs must be identical).",
+    )
+    text_parser.add_argument(
+        "--text-path",
+        type=Path,
+        help="Text file with a sentence per line (default: synthetic sentences).",
+    )
+    text_parser.add_argument("--num-texts", type=int, default=500_000)
+    text_parser.add_argument("--num-workers", type=int, default=os.cpu_count())
+    text_parser.add_argument("--chunk-size", type=int, default=50_000)
+    text_parser.set_defaults(func=benchmark_text)
+
+    empty_shard_parser = subparsers.add_parser(
+        "empty-shard",
+        help="Writing & merging the manifests of shards without any fileids "
+        + "(must not fail).",
+    )
+    empty_shard_parser.add_argument("--num-shards", type=int, default=4)
+    empty_shard_parser.set_defaults(func=check_empty_shard)
+
+    download_parser = subparsers.add_parser(
+        "download",
+        help="DownloadScheduler & HttpDownloader against a local stand-in server: "
+        + "success, retried 5xx errors, missing videos & outputs, rate limit.",
+    )
+    download_parser.add_argument("--video-mb", type=float, default=2)
+    download_parser.add_argument("--max-concurrency", type=int, default=4)
+    download_parser.add_argument("--max-bandwidth-mb", type=float, default=8)
+    download_parser.set_defaults(func=check_download)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,115 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import socket
+import numpy as np
+from pathlib import Path
+from functools import lru_cache
+
+
+class ClipStore:
+    """
+    Mouth-ROI clips of a split packed as raw uint8 frames instead of being
+    encoded as `.mp4` files. Every process appends the clips it writes to its
+    own `part-{host}-{pid}.u8` file and `.idx` index (one line per clip:
+    id, byte offset, num frames, height, width, channels), so no locking is
+    needed. Clips are read back with `np.memmap`; manifests point at them
+    with `{part_filepath}:{byte_offset}:{num_frames}` entries.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = Path(store_path)
+        self._files, self._pid = None, None
+        self._index, self._shapes = None, None
+        self.store_path.mkdir(parents=True, exist_ok=True)
+
+    def __getstate__(self):
+        return {"store_path": self.store_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["store_path"])
+
+    def open_part(self):
+        # part files can't be shared across processes
+        if self._files is None or self._pid != os.getpid():
+            # host names may contain dots, so suffixes are appended by hand
+            part_name = f"part-{socket.gethostname()}-{os.getpid()}"
+            self._files = (
+                open(self.store_path / f"{part_name}.u8", "ab"),
+                open(self.store_path / f"{part_name}.idx", "a"),
+            )
+            self._pid = os.getpid()
+        return self._files
+
+    def write(self, clip_id, frames):
+        """Appends `frames`, a (T, H, W) or (T, H, W, C) uint8 sequence"""
+        frames = np.ascontiguousarray(np.stack(frames), dtype=np.uint8)
+        if frames.ndim == 3:
+            frames = frames[..., None]
+        data_file, index_file = self.open_part()
+        offset = data_file.tell()
+        data_file.write(frames.data)
+        data_file.flush()
+        # the clip is only indexed once its frames are written
+        num_frames, height, width, channels = frames.shape
+        index_file.write(
+            f"{clip_id}\t{offset}\t{num_frames}\t{height}\t{width}\t{channels}\n"
+        )
+        index_file.flush()
+
+    def load_index(self):
+        self._index, self._shapes = {}, {}
+        for index_filepath in sorted(self.store_path.glob("part-*.idx")):
+            data_filepath = index_filepath.with_suffix(".u8")
+            with open(index_filepath) as fin:
+                for ln in fin:
+                    clip_id, *shape = ln.rstrip("\n").split("\t")
+                    offset, *shape = map(int, shape)
+                    # clips written again override previous ones
+                    self._index[clip_id] = (data_filepath, offset, tuple(shape))
+                    self._shapes[data_filepath.name, offset] = tuple(shape)
+
+    @property
+    def index(self):
+        """{clip_id: (part_filepath, byte_offset, clip_shape)} of all parts"""
+        if self._index is None:
+            self.load_index()
+        return self._index
+
+    @property
+    def shapes(self):
+        """{(part_filename, byte_offset): clip_shape} of all parts"""
+        if self._shapes is None:
+            self.load_index()
+        return self._shapes
+
+    def __contains__(self, clip_id):
+        return clip_id in self.index
+
+    def get_location(self, clip_id):
+        """Returns the manifest entry & the number of frames of a clip"""
+        data_filepath, offset, shape = self.index[clip_id]
+        return f"{data_filepath}:{offset}:{shape[0]}", shape[0]
+
+    def __getitem__(self, clip_id):
+        data_filepath, offset, shape = self.index[clip_id]
+        return np.memmap(data_filepath, np.uint8, "r", offset=offset, shape=shape)
+
+    @staticmethod
+    def load_clip(location):
+        """Memory-maps a clip from its `{part_filepath}:{offset}:{num_frames}`"""
+        data_filepath, offset, num_frames = location.rsplit(":", 2)
+        data_filepath, offset = Path(data_filepath), int(offset)
+        store = open_clip_store(data_filepath.parent)
+        shape = store.shapes[data_filepath.name, offset]
+        assert shape[0] == int(num_frames), f"{location} doesn't match its index!"
+        return np.memmap(data_filepath, np.uint8, "r", offset=offset, shape=shape)
+
+
+@lru_cache(maxsize=None)
+def open_clip_store(store_path):
+    """Clip stores are opened (and their index loaded) once per process"""
+    return ClipStore(store_path)
@@ -15,6 +15,7 @@ from scipy.io import wavfile
 from collections import OrderedDict, defaultdict
 
 from utils import (
+    interpolate_landmarks,
     load_meanface_metadata,
     download_extract_file_if_not,
 )
@@ -118,43 +119,11 @@ def add_noise(signal, noise, snr):
     return mixed
  
 
-def linear_interpolate(landmarks, start_idx, stop_idx):
-    start_landmarks = landmarks[start_idx]
-    stop_landmarks = landmarks[stop_idx]
-    delta = stop_landmarks - start_landmarks
-    for idx in range(1, stop_idx - start_idx):
-        landmarks[start_idx + idx] = (
-            start_landmarks + idx / float(stop_idx - start_idx) * delta
-        )
-    return landmarks
-
-
 def landmarks_interpolate(landmarks):
     """Interpolate landmarks
     param list landmarks: landmarks detected in raw videos
     """
-    valid_frames_idx = [idx for idx, _ in enumerate(landmarks) if _ is not None ]
-    if not valid_frames_idx:
-        return None
-    for idx in range(1, len(valid_frames_idx)):
-        if valid_frames_idx[idx] - valid_frames_idx[idx - 1] == 1:
-            continue
-        else:
-            landmarks = linear_interpolate(
-                landmarks, valid_frames_idx[idx - 1], valid_frames_idx[idx]
-            )
-    valid_frames_idx = [idx for idx, _ in enumerate(landmarks) if _ is not None]
-    # -- Corner case: keep frames at the beginning or at the end failed to be detected.
-    if valid_frames_idx:
-        landmarks[: valid_frames_idx[0]] = [
-            landmarks[valid_frames_idx[0]]
-        ] * valid_frames_idx[0]
-        landmarks[valid_frames_idx[-1] :] = [landmarks[valid_frames_idx[-1]]] * (
-            len(landmarks) - valid_frames_idx[-1]
-        )
-    valid_frames_idx = [idx for idx, _ in enumerate(landmarks) if _ is not None]
-    assert len(valid_frames_idx) == len(landmarks), "not every frame has landmark"
-    return landmarks
+    return interpolate_landmarks(landmarks)
  
  
 def track_time(func):
@@ -0,0 +1,315 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import json
+import time
+import random
+import yt_dlp
+import warnings
+import urllib.request
+from tqdm import tqdm
+from abc import ABC, abstractmethod
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ledger_utils import Ledger
+
+
+# yt-dlp error messages meaning that retrying won't help
+YT_UNAVAILABLE_MESSAGES = [
+    "Video unavailable",
+    "Private video",
+    "This video has been removed",
+    "This video is no longer available",
+]
+
+
+class VideoNotFoundError(Exception):
+    pass
+
+
+class VideoDownloader(ABC):
+    """
+    Downloads one video to `out_filepath`. Raises `VideoNotFoundError` when
+    the video doesn't exist anymore; any other exception is retried.
+    `rate_limit` is the max download speed in bytes/sec (None for no limit).
+    `face_size` is the face width (in pixels of the original video) found in
+    the landmark metadata & `landmark_extent` the (max x, max y) of its
+    landmarks, both None when the video has no metadata.
+    """
+
+    @abstractmethod
+    def download(
+        self,
+        video_id,
+        out_filepath,
+        rate_limit=None,
+        face_size=None,
+        landmark_extent=None,
+    ):
+        pass
+
+
+def write_video_resolution(out_filepath, height, ref_height):
+    """
+    Records the resolution a video was downloaded at next to it, along with
+    the reference (highest) resolution the landmark metadata belongs to.
+    """
+    with open(out_filepath.with_suffix(".json"), "w") as fout:
+        json.dump({"height": height, "ref_height": ref_height}, fout)
+
+
+class YouTubeDownloader(VideoDownloader):
+    """
+    Downloads the best mp4 stream by default. When `min_face_size` is set
+    (the dataset-grade profile), it downloads the lowest resolution where the
+    face is still at least `min_face_size` pixels wide; frames get warped to
+    the mean face anyway, so higher resolutions don't change the crops.
+    The landmarks are assumed to belong to the highest resolution; when they
+    don't fit in its frame, the best stream is downloaded instead.
+    """
+
+    def __init__(
+        self,
+        ydl_format="bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
+        min_face_size=None,
+        extent_tolerance=0.05,
+    ):
+        self.ydl_format = ydl_format
+        self.min_face_size = min_face_size
+        # landmark detectors may place points slightly outside of the frame
+        self.extent_tolerance = extent_tolerance
+
+    def run_ydl(self, video_id, ydl_opts, download=True):
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        with yt_dlp.YoutubeDL({"quiet": True, **ydl_opts}) as ydl:
+            try:
+                return ydl.extract_info(url, download=download)
+            except yt_dlp.utils.DownloadError as e:
+                if any(msg in str(e) for msg in YT_UNAVAILABLE_MESSAGES):
+                    raise VideoNotFoundError(video_id) from e
+                raise
+
+    def select_height(self, heights, face_size):
+        ref_height = max(heights)
+        if face_size is None:
+            # no landmarks, the whole frame gets resized to the crop size
+            return min(heights)
+        min_height = ref_height * self.min_face_size / face_size
+        return min((h for h in heights if h >= min_height), default=ref_height)
+
+    def fits_landmarks(self, landmark_extent, width, height, ref_height):
+        """
+        Whether the landmarks fit in the frame of the `height` stream scaled up
+        to `ref_height`, i.e. whether they were detected at `ref_height`.
+        """
+        if landmark_extent is None:
+            return True  # no landmarks to rescale
+        if not width:
+            return False
+        max_x, max_y = landmark_extent
+        scale = (ref_height / height) * (1 + self.extent_tolerance)
+        return max_x <= width * scale and max_y <= height * scale
+
+    def download(
+        self,
+        video_id,
+        out_filepath,
+        rate_limit=None,
+        face_size=None,
+        landmark_extent=None,
+    ):
+        ydl_format, ref_height = self.ydl_format, None
+        if self.min_face_size is not None:
+            # resolution of a previous attempt, it's written again if it holds
+            out_filepath.with_suffix(".json").unlink(missing_ok=True)
+            info = self.run_ydl(video_id, {}, download=False)
+            widths = {}  # height -> width
+            for f in info["formats"]:
+                if (
+                    f.get("ext") == "mp4"
+                    and f.get("vcodec") != "none"
+                    and f.get("height")
+                ):
+                    widths[f["height"]] = max(
+                        widths.get(f["height"], 0), f.get("width") or 0
+                    )
+            if widths:
+                height = self.select_height(set(widths), face_size)
+                if self.fits_landmarks(
+                    landmark_extent, widths[height], height, max(widths)
+                ):
+                    ref_height = max(widths)
+                    # the last alternatives keep a video without an mp4/m4a
+                    # stream at `height` downloadable, at the best resolution
+                    ydl_format = (
+                        f"bestvideo[ext=mp4][height={height}]+bestaudio[ext=m4a]"
+                        + f"/best[ext=mp4][height={height}]"
+                        + f"/{self.ydl_format}"
+                    )
+                else:
+                    warnings.warn(
+                        f"Landmarks of `{video_id}` don't fit in its "
+                        + f"{max(widths)}p frame... downloading the best "
+                        + "resolution instead!!"
+                    )
+        info = self.run_ydl(
+            video_id,
+            {
+                "format": ydl_format,
+                "outtmpl": str(out_filepath),
+                "continuedl": True,  # resume `.part` files of previous attempts
+                "retries": 0,  # retries are handled by the scheduler
+                "ratelimit": rate_limit,
+            },
+        )
+        if ref_height is not None:
+            # recorded from the downloaded stream, a fallback may have another
+            write_video_resolution(
+                out_filepath, info.get("height") or height, ref_height
+            )
+
+
+class HttpDownloader(VideoDownloader):
+    """
+    Downloads videos from `url_template` (e.g. `http://host/{video_id}.mp4`),
+    such as a mirror or a local stand-in server. Partial downloads are resumed
+    with HTTP range requests.
+    """
+
+    def __init__(self, url_template, timeout=60, chunk_size=1 << 20):
+        self.url_template = url_template
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+    def download(
+        self,
+        video_id,
+        out_filepath,
+        rate_limit=None,
+        face_size=None,
+        landmark_extent=None,
+    ):
+        part_filepath = out_filepath.with_name(f"{out_filepath.name}.part")
+        offset = part_filepath.stat().st_size if part_filepath.exists() else 0
+        request = urllib.request.Request(
+            self.url_template.format(video_id=video_id),
+            headers={"Range": f"bytes={offset}-"} if offset else {},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                # server may ignore the range & send the whole file
+                mode = "ab" if response.status == 206 else "wb"
+                with open(part_filepath, mode) as fout:
+                    start_time, num_bytes = time.monotonic(), 0
+                    while chunk := response.read(self.chunk_size):
+                        fout.write(chunk)
+                        num_bytes += len(chunk)
+                        if rate_limit:
+                            ahead = num_bytes / rate_limit - (time.monotonic() - start_time)
+                            if ahead > 0:
+                                time.sleep(ahead)
+        except HTTPError as e:
+            if e.code == 404:
+                raise VideoNotFoundError(video_id) from e
+            if e.code != 416:  # 416: nothing left to download
+                raise
+        os.replace(part_filepath, out_filepath)
+
+
+class DownloadScheduler:
+    """
+    Downloads videos with a fixed number of threads (downloads are I/O-bound),
+    retrying failures with exponential backoff. The status of every video is
+    kept in the ledger: downloaded & not-found videos are skipped in later
+    runs while failed ones are tried again.
+    """
+
+    def __init__(
+        self,
+        downloader,
+        ledger,
+        max_concurrency=8,
+        max_retries=3,
+        backoff_sec=5.0,
+        max_bandwidth=None,
+    ):
+        self.downloader = downloader
+        self.ledger = ledger
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_sec = backoff_sec
+        # split the total bandwidth (bytes/sec) between concurrent downloads
+        self.rate_limit = max_bandwidth / max_concurrency if max_bandwidth else None
+
+    def download_with_retries(
+        self, video_id, out_filepath, face_size=None, landmark_extent=None
+    ):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.downloader.download(
+                    video_id, out_filepath, self.rate_limit, face_size, landmark_extent
+                )
+                return Ledger.DONE
+            except VideoNotFoundError:
+                return "not_found"
+            except Exception:
+                if attempt == self.max_retries:
+                    return "failed"
+                # exponential backoff with jitter
+                time.sleep(self.backoff_sec * 2**attempt * random.uniform(0.5, 1.5))
+
+    def run(
+        self,
+        video_ids,
+        out_path,
+        stage,
+        desc=None,
+        face_sizes=None,
+        landmark_extents=None,
+    ):
+        """
+        Downloads the pending `video_ids`, returns {video_id: status}.
+        `face_sizes` & `landmark_extents` optionally map video ids to their
+        face size & landmark extent in pixels (see `VideoDownloader`).
+        """
+        face_sizes = face_sizes or {}
+        landmark_extents = landmark_extents or {}
+        statuses = self.ledger.get_statuses(stage)
+        pending_ids = [
+            id_
+            for id_ in video_ids
+            if statuses.get(id_) not in {Ledger.DONE, "not_found"}
+        ]
+        if not pending_ids:
+            return {id_: statuses[id_] for id_ in video_ids}
+        start_time, num_bytes = time.monotonic(), 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {
+                executor.submit(
+                    self.download_with_retries,
+                    id_,
+                    out_path / f"{id_}.mp4",
+                    face_sizes.get(id_),
+                    landmark_extents.get(id_),
+                ): id_
+                for id_ in pending_ids
+            }
+            with tqdm(total=len(futures), desc=desc) as pbar:
+                for future in as_completed(futures):
+                    id_ = futures[future]
+                    statuses[id_] = future.result()
+                    out_filepath = out_path / f"{id_}.mp4"
+                    if statuses[id_] == Ledger.DONE and not out_filepath.exists():
+                        # the downloader returned without writing the video
+                        statuses[id_] = "failed"
+                    self.ledger.mark(stage, id_, statuses[id_])
+                    if statuses[id_] == Ledger.DONE:
+                        num_bytes += out_filepath.stat().st_size
+                    elapsed = time.monotonic() - start_time
+                    pbar.set_postfix(MBps=f"{num_bytes / elapsed / 1e6:.1f}")
+                    pbar.update()
+        return {id_: statuses[id_] for id_ in video_ids}
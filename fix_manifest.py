@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from mtedx_utils import prepare_mtedx_avsr_manifests
+from resource_utils import ResourceGovernor
 
 if __name__ == "__main__":
     # 1. CRITICAL FIX: Force the "Current Directory" to be the folder containing this script.
@@ -17,5 +18,5 @@ if __name__ == "__main__":
     print("Generating missing .tsv files for German...")
     
     # 3. Generate the manifests
-    prepare_mtedx_avsr_manifests(mtedx_path, "de", muavic_path)
+    prepare_mtedx_avsr_manifests(mtedx_path, "de", muavic_path, ResourceGovernor())
     print("Done! Check data/muavic/de/ folder.")
\ No newline at end of file
@@ -8,6 +8,9 @@ from pathlib import Path
 
 from mtedx_utils import *
 from lrs3_utils import *
+from resource_utils import ResourceGovernor
+from shard_utils import parse_shard
+from length_utils import index_manifests
 
 
 def prepare_mtedx(args):
@@ -17,18 +20,83 @@ def prepare_mtedx(args):
         download_mtedx_data(args["mtedx"], args["src_lang"], "en")
 
     # download mTEDx videos
-    download_mtedx_lang_videos(args["mtedx"], args["src_lang"])
+    if args["video_mirror"]:
+        downloader = HttpDownloader(args["video_mirror"])
+    elif args["download_profile"] == "dataset":
+        min_face_size = args["min_face_size"]
+        if min_face_size is None:
+            # faces get warped to the mean face, avoid upsampling them
+            mean_face_metadata = load_meanface_metadata(args["metadata"])
+            min_face_size = get_face_size([mean_face_metadata])
+        downloader = YouTubeDownloader(min_face_size=min_face_size)
+    else:
+        downloader = YouTubeDownloader()
+    scheduler = DownloadScheduler(
+        downloader,
+        args["ledger"],
+        max_concurrency=args["download_workers"] or args["governor"].io_workers,
+        max_bandwidth=(
+            args["max_download_rate"] * 1e6 if args["max_download_rate"] else None
+        ),
+    )
+    download_mtedx_lang_videos(
+        args["mtedx"],
+        args["src_lang"],
+        args["ledger"],
+        scheduler,
+        metadata_path=(
+            args["metadata"] if args["download_profile"] == "dataset" else None
+        ),
+        shard=args["shard"],
+    )
 
     # pre-process audio files
-    preprocess_mtedx_audio(args["mtedx"], args["src_lang"], args["muavic"])
+    preprocess_mtedx_audio(
+        args["mtedx"],
+        args["src_lang"],
+        args["muavic"],
+        args["ledger"],
+        args["governor"],
+        shard=args["shard"],
+    )
 
     # process video files
     preprocess_mtedx_video(
-        args["mtedx"], args["metadata"], args["src_lang"], args["muavic"]
+        args["mtedx"],
+        args["metadata"],
+        args["src_lang"],
+        args["muavic"],
+        args["ledger"],
+        args["governor"],
+        args["video_format"],
+        args["grayscale"],
+        shard=args["shard"],
     )
 
     # prepare AVSR manifests
-    prepare_mtedx_avsr_manifests(args["mtedx"], args["src_lang"], args["muavic"])
+    prepare_mtedx_avsr_manifests(
+        args["mtedx"],
+        args["src_lang"],
+        args["muavic"],
+        args["governor"],
+        args["video_format"],
+        shard=args["shard"],
+    )
+    if args["shard"] is not None:
+        return  # AVST manifests are prepared by `--merge`
+
+    # prepare AVST manifests
+    if args["src_lang"] not in {"ar", "de"}:
+        prepare_mtedx_avst_manifests(
+            args["mtedx"], args["mt_trans"], args["src_lang"], args["muavic"]
+        )
+
+
+def merge_mtedx(args):
+    # build AVSR manifests from the shards' ones
+    merge_mtedx_avsr_manifests(
+        args["mtedx"], args["src_lang"], args["muavic"], args["merge"]
+    )
 
     # prepare AVST manifests
     if args["src_lang"] not in {"ar", "de"}:
@@ -55,17 +123,49 @@ def prepare_lrs3(args):
                     f"{args['lrs3']}/{split} is not found!!"
                 )
     # segment LRS3 pretrain set
-    segment_pretrain_videos_and_text(args["lrs3"])
+    segment_pretrain_videos_and_text(
+        args["lrs3"], args["ledger"], args["governor"], shard=args["shard"]
+    )
 
     # process LRS3 videos
-    process_lrs3_videos(args["lrs3"], args["metadata"], args["muavic"])
+    process_lrs3_videos(
+        args["lrs3"],
+        args["metadata"],
+        args["muavic"],
+        args["ledger"],
+        args["governor"],
+        args["video_format"],
+        args["grayscale"],
+        shard=args["shard"],
+    )
 
     # prepare AVSR manifests
-    prepare_lrs3_avsr_manifests(args["lrs3"], args["muavic"])
+    prepare_lrs3_avsr_manifests(
+        args["lrs3"],
+        args["muavic"],
+        args["governor"],
+        args["video_format"],
+        shard=args["shard"],
+    )
+    if args["shard"] is not None:
+        return  # AVST manifests are prepared by `--merge`
 
     # prepare AVST manifests
-    download_ted2020(args["ted2020"])
-    prepare_lrs3_avst_manifests(args["mt_trans"], args["ted2020"], args["muavic"])
+    download_ted2020(args["ted2020"], args["governor"])
+    prepare_lrs3_avst_manifests(
+        args["mt_trans"], args["ted2020"], args["muavic"], args["governor"]
+    )
+
+
+def merge_lrs3(args):
+    # build AVSR manifests from the shards' ones
+    merge_lrs3_avsr_manifests(args["muavic"], args["merge"])
+
+    # prepare AVST manifests
+    download_ted2020(args["ted2020"], args["governor"])
+    prepare_lrs3_avst_manifests(
+        args["mt_trans"], args["ted2020"], args["muavic"], args["governor"]
+    )
 
 
 def main(args):
@@ -74,15 +174,42 @@ def main(args):
     for dirname in dirs:
         args[dirname] = args["root_path"] / dirname
         args[dirname].mkdir(parents=True, exist_ok=True)
+    # keeps track of the processed items of every stage (to resume from),
+    # shards keep their own ledger since they may run on different machines
+    ledger_filename = "ledger.db"
+    if args["shard"] is not None:
+        ledger_filename = "ledger.{}-of-{}.db".format(*args["shard"])
+    args["ledger"] = Ledger(args["ledger_path"] or args["root_path"] / ledger_filename)
+    # every stage draws its workers & ffmpeg/sox children from this budget
+    args["governor"] = ResourceGovernor(
+        args["num_workers"], args["io_workers"], args["max_subprocesses"]
+    )
 
     # start creating MuAViC
-    if args["src_lang"] == "en":
+    if args["src_lang"] == "en" and args["merge"]:
+        # merge the LRS3 shards
+        merge_lrs3(args)
+    elif args["src_lang"] == "en":
         # preapre LRS3 data
         prepare_lrs3(args)
+    elif args["merge"]:
+        # merge the mTEDx shards
+        merge_mtedx(args)
     else:
         # Prepare mTEDx data
         prepare_mtedx(args)
 
+    if args["shard"] is None:
+        # length index (& length-bucketed variants) of every manifest
+        index_manifests(args["muavic"] / args["src_lang"], args["num_buckets"])
+
+    # report how well every stage used its workers
+    args["governor"].report()
+    if args["shard"] is not None:
+        # other shards may still need the metadata
+        print("Shard {}/{} is completed!! \u2705".format(*args["shard"]))
+        return
+
     # clear out un-needed directories
     shutil.rmtree(args["mt_trans"])
     shutil.rmtree(args["metadata"])
@@ -105,11 +232,94 @@ if __name__ == "__main__":
         choices=["ar", "de", "el", "en", "es", "fr", "it", "pt", "ru"],
         help="The language code for the source language in MuAViC.",
     )
+    parser.add_argument(
+        "--ledger-path",
+        type=Path,
+        help="Path of the SQLite file tracking processed items, preferably on a "
+        + "local disk (default: ${ROOT}/ledger.db).",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        help="Number of videos to download concurrently "
+        + "(default: `--io-workers`).",
+    )
+    parser.add_argument(
+        "--max-download-rate",
+        type=float,
+        help="Max total download bandwidth in MB/s (default: unlimited).",
+    )
+    parser.add_argument(
+        "--video-mirror",
+        help="URL template to download videos from instead of YouTube, "
+        + "e.g. `http://host/videos/{video_id}.mp4`.",
+    )
+    parser.add_argument(
+        "--download-profile",
+        default="best",
+        choices=["best", "dataset"],
+        help="`best` downloads the highest resolution, `dataset` the lowest one "
+        + "where faces are at least `--min-face-size` pixels wide.",
+    )
+    parser.add_argument(
+        "--min-face-size",
+        type=float,
+        help="Min face width in pixels for `--download-profile dataset` "
+        + "(default: the mean face width).",
+    )
+    parser.add_argument(
+        "--video-format",
+        default="mp4",
+        choices=["mp4", "raw"],
+        help="`mp4` encodes every mouth-ROI clip with libx264, `raw` packs them "
+        + "as uint8 frames per split (`video_raw/`) that can be memory-mapped.",
+    )
+    parser.add_argument(
+        "--grayscale",
+        action="store_true",
+        help="Decode, crop & store single-channel (grayscale) mouth-ROI clips.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only process the K-th of N shards (e.g. `0/4`); shards can run on "
+        + "different machines sharing `--root-path`. Run `--merge N` afterwards.",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        metavar="N",
+        help="Build the manifests from the outputs of all `--shard K/N` runs "
+        + "without processing any media.",
+    )
+    parser.add_argument(
+        "--num-buckets",
+        default=0,
+        type=int,
+        help="Also write `{split}_bucketed.tsv` manifests (& labels) whose samples "
+        + "are grouped into this many length buckets (default: none).",
+    )
     parser.add_argument(
         "--num-workers",
         default=os.cpu_count(),
-        help="Max number of workers to be used in parallel.",
+        type=int,
+        help="Max number of worker processes for CPU-bound stages.",
+    )
+    parser.add_argument(
+        "--io-workers",
+        default=8,
+        type=int,
+        help="Max number of threads for I/O-bound stages (downloads, manifests).",
+    )
+    parser.add_argument(
+        "--max-subprocesses",
+        type=int,
+        help="Max number of ffmpeg/sox decoders & encoders running at once, each "
+        + "using `--num-workers / --max-subprocesses` threads "
+        + "(default: `--num-workers`).",
     )
 
     args = vars(parser.parse_args())
+    if args["shard"] is not None and args["merge"] is not None:
+        parser.error("--shard and --merge can't be used together")
     main(args)
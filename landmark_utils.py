@@ -0,0 +1,127 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import pickle
+import numpy as np
+from functools import lru_cache
+
+from ledger_utils import atomic_output, exclusive_lock
+from utils import download_video_metadata
+
+
+class LandmarkStore:
+    """
+    Landmarks of every segment of a language/split, converted once from the
+    per-video `.pkl` metadata into a single memory-mapped float32 array of
+    shape (N, 68, 2) (frames without a detection are NaN) and an index from
+    `{video_id}/{seg_id}` to the segment's rows.
+    """
+
+    LANDMARK_SHAPE = (68, 2)
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        data_filepath, index_filepath = LandmarkStore.get_filepaths(store_path)
+        index = np.load(index_filepath)
+        self.index = dict(
+            zip(
+                index["keys"].tolist(),
+                zip(index["offsets"].tolist(), index["lengths"].tolist()),
+            )
+        )
+        self.video_ids = {key.rpartition("/")[0] for key in self.index}
+        num_frames = int(index["lengths"].sum())
+        if num_frames == 0:  # empty files can't be memory-mapped
+            self.data = np.empty((0, *LandmarkStore.LANDMARK_SHAPE), np.float32)
+        else:
+            self.data = np.memmap(
+                data_filepath,
+                dtype=np.float32,
+                mode="r",
+                shape=(num_frames, *LandmarkStore.LANDMARK_SHAPE),
+            )
+
+    def __getstate__(self):
+        # don't copy the memory-mapped data into worker processes
+        return {"store_path": self.store_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["store_path"])
+
+    @staticmethod
+    def get_filepaths(store_path):
+        return (
+            store_path.with_name(f"{store_path.name}.f32"),
+            store_path.with_name(f"{store_path.name}.npz"),
+        )
+
+    @staticmethod
+    def exists(store_path):
+        # the index is written last
+        return LandmarkStore.get_filepaths(store_path)[1].exists()
+
+    @staticmethod
+    def build(metadata_dir_path, store_path):
+        """Converts all `.pkl` files under `metadata_dir_path` into a store"""
+        data_filepath, index_filepath = LandmarkStore.get_filepaths(store_path)
+        keys, offsets, lengths = [], [], []
+        offset = 0
+        with atomic_output(data_filepath) as tmp_filepath:
+            with open(tmp_filepath, "wb") as fout:
+                for pkl_filepath in sorted(metadata_dir_path.rglob("*.pkl")):
+                    video_id = str(
+                        pkl_filepath.relative_to(metadata_dir_path).with_suffix("")
+                    )
+                    with open(pkl_filepath, "rb") as fin:
+                        metadata = pickle.load(fin)
+                    for seg_id, seg_metadata in metadata.items():
+                        landmarks = np.full(
+                            (len(seg_metadata), *LandmarkStore.LANDMARK_SHAPE),
+                            np.nan,
+                            dtype=np.float32,
+                        )
+                        for i, frame_landmarks in enumerate(seg_metadata):
+                            if frame_landmarks is not None:
+                                landmarks[i] = frame_landmarks
+                        fout.write(landmarks.tobytes())
+                        keys.append(f"{video_id}/{seg_id}")
+                        offsets.append(offset)
+                        lengths.append(len(landmarks))
+                        offset += len(landmarks)
+        with atomic_output(index_filepath) as tmp_filepath:
+            with open(tmp_filepath, "wb") as fout:
+                np.savez(
+                    fout,
+                    keys=np.array(keys, dtype=str),
+                    offsets=np.array(offsets, dtype=np.int64),
+                    lengths=np.array(lengths, dtype=np.int64),
+                )
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        """Returns a read-only (T, 68, 2) view of the segment's landmarks"""
+        offset, length = self.index[key]
+        return np.asarray(self.data[offset : offset + length])
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+@lru_cache(maxsize=None)
+def load_landmark_store(metadata_dir_path):
+    """
+    Returns the landmark store of `metadata_dir_path` (e.g. `metadata/es/train`)
+    building it first if needed; stores are opened once per process.
+    """
+    store_path = metadata_dir_path.with_name(f"{metadata_dir_path.name}_landmarks")
+    if not LandmarkStore.exists(store_path):
+        download_video_metadata(metadata_dir_path.parent)
+        # a single process (of all shards) builds the store, others wait
+        with exclusive_lock(store_path.with_name(f".{store_path.name}.lock")):
+            if not LandmarkStore.exists(store_path):
+                LandmarkStore.build(metadata_dir_path, store_path)
+    return LandmarkStore(store_path)
@@ -0,0 +1,217 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import time
+import socket
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+
+# file systems where SQLite's WAL mode is unsafe: its shared-memory index
+# (`*.db-shm`) only works when every connection runs on the same host
+NETWORK_FILESYSTEMS = set(
+    "nfs nfs4 cifs smb3 smbfs afs 9p lustre gpfs beegfs ceph glusterfs "
+    "fuse.sshfs fuse.glusterfs fuse.s3fs".split()
+)
+
+
+def get_filesystem_type(path):
+    """Returns the type of the file system holding `path` (Linux only)"""
+    path = Path(path).resolve()
+    fs_type, mount_depth = None, -1
+    try:
+        with open("/proc/mounts") as fin:
+            for line in fin:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # mount points escape spaces as `\040`
+                mount_point = Path(fields[1].replace("\\040", " "))
+                if mount_point != path and mount_point not in path.parents:
+                    continue
+                # the deepest (and latest) mount point holding `path` wins
+                if len(mount_point.parts) >= mount_depth:
+                    fs_type, mount_depth = fields[2], len(mount_point.parts)
+    except OSError:
+        pass  # not Linux
+    return fs_type
+
+
+def is_network_filesystem(path):
+    return get_filesystem_type(path) in NETWORK_FILESYSTEMS
+
+
+# connections of the current process & thread by database: the ledgers
+# unpickled for every task of `ResourceGovernor.map()` reuse the connection
+# their worker opened first, instead of opening (& locking) one per task
+_ledger_connections = threading.local()
+
+
+class Ledger:
+    """
+    Persistent record of the items every stage has processed, kept in a local
+    SQLite database. It can be passed to worker processes; each process (and
+    thread) opens its own connection on first use and keeps it for the later
+    tasks. On network file systems, the database uses the rollback journal
+    instead of WAL.
+    """
+
+    DONE = "done"
+    STAGE_ITEM = "*"  # item marking a whole stage as done
+
+    def __init__(self, db_filepath):
+        self.db_filepath = Path(db_filepath)
+        self.db_filepath.parent.mkdir(parents=True, exist_ok=True)
+        self.journal_mode = "WAL"
+        if is_network_filesystem(self.db_filepath.parent):
+            print(
+                f"`{self.db_filepath}` is on a network file system, "
+                + "its journal mode is set to DELETE (slower)."
+            )
+            self.journal_mode = "DELETE"
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            + "stage TEXT NOT NULL, "
+            + "item TEXT NOT NULL, "
+            + "status TEXT NOT NULL, "
+            + "attempts INTEGER NOT NULL DEFAULT 1, "
+            + "updated REAL NOT NULL, "
+            + "PRIMARY KEY (stage, item))"
+        )
+
+    def __getstate__(self):
+        return {"db_filepath": self.db_filepath, "journal_mode": self.journal_mode}
+
+    def __setstate__(self, state):
+        self.db_filepath = state["db_filepath"]
+        self.journal_mode = state["journal_mode"]
+
+    @property
+    def connection(self):
+        # sqlite connections can't be shared across processes (a forked
+        # worker inherits the thread-local connections of its parent)
+        if getattr(_ledger_connections, "pid", None) != os.getpid():
+            _ledger_connections.pid = os.getpid()
+            _ledger_connections.connections = {}
+        connections = _ledger_connections.connections
+        if self.db_filepath not in connections:
+            conn = sqlite3.connect(self.db_filepath, timeout=600, isolation_level=None)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            connections[self.db_filepath] = conn
+        return connections[self.db_filepath]
+
+    def mark(self, stage, item, status=DONE):
+        self.connection.execute(
+            "INSERT INTO ledger (stage, item, status, updated) "
+            + "VALUES (?, ?, ?, ?) "
+            + "ON CONFLICT (stage, item) DO UPDATE SET "
+            + "status = excluded.status, "
+            + "attempts = attempts + 1, "
+            + "updated = excluded.updated",
+            (stage, item, status, time.time()),
+        )
+
+    def get_status(self, stage, item):
+        row = self.connection.execute(
+            "SELECT status FROM ledger WHERE stage = ? AND item = ?", (stage, item)
+        ).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, stage, item):
+        return self.get_status(stage, item) == Ledger.DONE
+
+    def get_statuses(self, stage):
+        """Returns {item: status} for every recorded item of `stage`"""
+        return dict(
+            self.connection.execute(
+                "SELECT item, status FROM ledger WHERE stage = ? AND item != ?",
+                (stage, Ledger.STAGE_ITEM),
+            )
+        )
+
+    def done_items(self, stage):
+        return {
+            item
+            for item, status in self.get_statuses(stage).items()
+            if status == Ledger.DONE
+        }
+
+    def mark_stage_done(self, stage):
+        self.mark(stage, Ledger.STAGE_ITEM)
+
+    def is_stage_done(self, stage):
+        return self.is_done(stage, Ledger.STAGE_ITEM)
+
+
+@contextmanager
+def atomic_output(out_filepath):
+    """
+    Yields a temporary `*.part` path to write `out_filepath` to; it is renamed
+    into place only when the block finishes without errors. Writers should
+    set the output format explicitly since the suffix is `.part`. The host
+    name keeps shards on different machines from sharing temporary files.
+    """
+    out_filepath = Path(out_filepath)
+    tmp_filepath = out_filepath.with_name(
+        f"{out_filepath.name}.{socket.gethostname()}-{os.getpid()}.part"
+    )
+    try:
+        yield tmp_filepath
+        os.replace(tmp_filepath, out_filepath)
+    finally:
+        if tmp_filepath.exists():
+            tmp_filepath.unlink()
+
+
+def is_stale_lock(lock_filepath):
+    """Whether the lock was left by a process of this host that has died"""
+    try:
+        hostname, _, pid = lock_filepath.read_text().partition(" ")
+    except FileNotFoundError:
+        return False  # just released
+    if hostname != socket.gethostname() or not pid.isdigit():
+        return False  # held by another machine (or still being written)
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # alive, owned by another user
+    return False
+
+
+@contextmanager
+def exclusive_lock(lock_filepath, poll_sec=5.0):
+    """
+    Holds `lock_filepath` while the block runs, so that a single process (of
+    all shards sharing the directory) does the work while the others wait for
+    it. The lock file is created with O_CREAT|O_EXCL, which is atomic on local
+    & network filesystems. Locks left by dead processes of the same host are
+    taken over; a lock left by a crashed machine has to be deleted by hand.
+    """
+    lock_filepath = Path(lock_filepath)
+    waiting = False
+    while True:
+        try:
+            fd = os.open(lock_filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if is_stale_lock(lock_filepath):
+                lock_filepath.unlink(missing_ok=True)
+                continue
+            if not waiting:
+                print(f"Waiting for `{lock_filepath}` to be released...")
+                waiting = True
+            time.sleep(poll_sec)
+    with os.fdopen(fd, "w") as fout:
+        fout.write(f"{socket.gethostname()} {os.getpid()}")
+    try:
+        yield
+    finally:
+        lock_filepath.unlink(missing_ok=True)
@@ -0,0 +1,212 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import argparse
+import warnings
+import numpy as np
+from pathlib import Path
+
+from utils import read_txt_file, write_txt_file
+from ledger_utils import atomic_output
+from manifest_utils import COUNT_COLUMNS, load_manifest, read_manifest, write_manifest
+
+
+# AV-HuBERT measures the size of a sample (& `dataset.max_tokens`) in video frames
+LENGTH_COLUMN = "video_frames"
+NUM_HIST_BINS = 50
+BUCKETED_SUFFIX = "_bucketed"
+
+
+def get_length_index_filepath(manifest_filepath):
+    """`{dir}/train.tsv` -> `{dir}/train.lengths.npz`"""
+    return manifest_filepath.with_name(f"{manifest_filepath.stem}.lengths.npz")
+
+
+def compute_length_index(manifest, num_bins=NUM_HIST_BINS):
+    """
+    Returns the lengths of every sample, their histogram (samples with
+    missing audio/video, i.e. negative lengths, aren't counted) and the
+    sample indices sorted by `LENGTH_COLUMN`.
+    """
+    index = {}
+    for col in COUNT_COLUMNS:
+        lengths = np.asarray(manifest[col], dtype=np.int64)
+        hist, edges = np.histogram(lengths[lengths >= 0], bins=num_bins)
+        index[col] = lengths
+        index[f"{col}_hist"] = hist
+        index[f"{col}_edges"] = edges
+    index["order"] = np.argsort(index[LENGTH_COLUMN], kind="stable")
+    return index
+
+
+def write_length_index(manifest_filepath, num_bins=NUM_HIST_BINS):
+    index = compute_length_index(load_manifest(manifest_filepath), num_bins)
+    with atomic_output(get_length_index_filepath(manifest_filepath)) as tmp_filepath:
+        with open(tmp_filepath, "wb") as fout:
+            np.savez(fout, **index)
+    return index
+
+
+def read_length_index(manifest_filepath):
+    """Returns the length index of `manifest_filepath`, built if needed"""
+    index_filepath = get_length_index_filepath(manifest_filepath)
+    if (
+        index_filepath.exists()
+        and index_filepath.stat().st_mtime >= manifest_filepath.stat().st_mtime
+    ):
+        with np.load(index_filepath) as index:
+            return dict(index)
+    return write_length_index(manifest_filepath)
+
+
+def get_bucket_order(lengths, num_buckets, seed=0):
+    """
+    Returns the sample indices grouped into `num_buckets` buckets with the
+    same number of samples, from the shortest samples to the longest ones.
+    Samples are shuffled within their bucket.
+    """
+    rng = np.random.default_rng(seed)
+    buckets = np.array_split(np.argsort(lengths, kind="stable"), num_buckets)
+    return np.concatenate([rng.permutation(bucket) for bucket in buckets])
+
+
+def estimate_padding(lengths, order, max_tokens):
+    """
+    Batches the samples in `order` like fairseq's `batch_by_size()` (a batch
+    grows until `batch_size * max_length` exceeds `max_tokens`) and returns
+    the number of batches & the fraction of padded tokens in them.
+    """
+    lengths = np.asarray(lengths)
+    num_batches = padded_tokens = batch_size = max_length = 0
+    for length in lengths[order].tolist():
+        if length < 0:
+            continue  # missing audio/video
+        new_max_length = max(max_length, length)
+        if batch_size and new_max_length * (batch_size + 1) > max_tokens:
+            num_batches += 1
+            padded_tokens += batch_size * max_length
+            batch_size, new_max_length = 0, length
+        batch_size += 1
+        max_length = new_max_length
+    if batch_size:
+        num_batches += 1
+        padded_tokens += batch_size * max_length
+    num_tokens = int(lengths[lengths >= 0].sum())
+    return num_batches, 1 - num_tokens / padded_tokens if padded_tokens else 0.0
+
+
+def get_label_filepaths(manifest_filepath):
+    """Returns the label files of a manifest, e.g. `train.es` for `train.tsv`"""
+    return sorted(
+        filepath
+        for filepath in manifest_filepath.parent.glob(f"{manifest_filepath.stem}.*")
+        if filepath.is_file() and filepath.suffix not in {".tsv", ".npz"}
+    )
+
+
+def write_bucketed_manifest(manifest_filepath, num_buckets, seed=0):
+    """
+    Writes `{split}_bucketed.tsv` & its label files: a variant of the manifest
+    whose samples are ordered by length buckets (see `get_bucket_order()`),
+    so consecutive samples have similar lengths and batches need less padding
+    when they're taken in the manifest order. It's rewritten when the manifest
+    or its labels are newer.
+    """
+    out_filepath = manifest_filepath.with_name(
+        f"{manifest_filepath.stem}{BUCKETED_SUFFIX}.tsv"
+    )
+    label_filepaths = get_label_filepaths(manifest_filepath)
+    if out_filepath.exists() and out_filepath.stat().st_mtime >= max(
+        filepath.stat().st_mtime for filepath in [manifest_filepath, *label_filepaths]
+    ):
+        return  # up to date
+    df = read_manifest(manifest_filepath)
+    order = get_bucket_order(df[LENGTH_COLUMN].to_numpy(), num_buckets, seed)
+    for label_filepath in label_filepaths:
+        labels = list(read_txt_file(label_filepath))
+        if len(labels) != len(df):
+            warnings.warn(
+                f"`{label_filepath}` doesn't match `{manifest_filepath}`... skipping!!"
+            )
+            continue
+        write_txt_file(
+            [labels[idx] for idx in order],
+            out_filepath.with_suffix(label_filepath.suffix),
+        )
+    # the manifest is written last, it marks the variant as complete
+    write_manifest(df.iloc[order], out_filepath)
+
+
+def index_manifests(data_path, num_buckets=0):
+    """
+    Writes the length index of every manifest under `data_path` and, with
+    `num_buckets`, their length-bucketed variants.
+    """
+    for manifest_filepath in sorted(data_path.rglob("*.tsv")):
+        is_shard = manifest_filepath.parent.name == "shards"
+        if is_shard or manifest_filepath.stem.endswith(BUCKETED_SUFFIX):
+            continue
+        write_length_index(manifest_filepath)
+        if num_buckets:
+            write_bucketed_manifest(manifest_filepath, num_buckets)
+
+
+def report_padding(manifest_filepath, max_tokens, num_buckets):
+    index = read_length_index(manifest_filepath)
+    lengths = index[LENGTH_COLUMN]
+    valid_lengths = lengths[lengths >= 0]
+    print(
+        f"{manifest_filepath}: {len(lengths)} samples "
+        + f"({len(lengths) - len(valid_lengths)} missing), {LENGTH_COLUMN} "
+        + "min/median/max = {}/{}/{}".format(
+            *(np.percentile(valid_lengths, [0, 50, 100]).astype(int).tolist())
+            if len(valid_lengths)
+            else ("-", "-", "-")
+        )
+    )
+    hist, edges = index[f"{LENGTH_COLUMN}_hist"], index[f"{LENGTH_COLUMN}_edges"]
+    scale = 40 / max(hist.max(initial=0), 1)
+    for count, start, end in zip(hist.tolist(), edges[:-1], edges[1:]):
+        print(f"  [{start:7.0f}, {end:7.0f}) {count:8d} {'#' * round(count * scale)}")
+    orders = {
+        "manifest order": np.arange(len(lengths)),
+        f"{num_buckets} length buckets": get_bucket_order(lengths, num_buckets),
+        # fairseq's AV-HuBERT dataset sorts by size itself when batching
+        "sorted by length": index["order"],
+    }
+    print(f"Estimated padding with max_tokens={max_tokens}:")
+    for name, order in orders.items():
+        num_batches, padding = estimate_padding(lengths, order, max_tokens)
+        print(f"  {name:>20}: {num_batches:8d} batches, {padding:6.1%} padding")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reports the length histogram of MuAViC manifests and the "
+        + "padding their batches would need."
+    )
+    parser.add_argument("manifests", nargs="+", type=Path, help="`.tsv` manifests.")
+    parser.add_argument(
+        "--max-tokens",
+        default=3000,
+        type=int,
+        help="Batch budget in video frames, as `dataset.max_tokens` in fairseq.",
+    )
+    parser.add_argument(
+        "--num-buckets",
+        default=32,
+        type=int,
+        help="Number of length buckets of the bucketed order.",
+    )
+    parser.add_argument(
+        "--write-bucketed",
+        action="store_true",
+        help="Also write the `{split}_bucketed.tsv` variants & their labels.",
+    )
+    args = parser.parse_args()
+    for manifest_filepath in args.manifests:
+        report_padding(manifest_filepath, args.max_tokens, args.num_buckets)
+        if args.write_bucketed:
+            write_bucketed_manifest(manifest_filepath, args.num_buckets)
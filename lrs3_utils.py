@@ -4,14 +4,23 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 import os, re
+import csv
 import shutil
-import xmltodict
+import pickle
 import pandas as pd
 from gzip import GzipFile
+from xml.etree import ElementTree
+from pathlib import Path
 from functools import partial
-from tqdm.contrib.concurrent import process_map
+from contextlib import ExitStack, closing
+from itertools import repeat
 
 from utils import *
+from landmark_utils import load_landmark_store
+from manifest_utils import MANIFEST_COLUMNS, load_manifest
+from clip_store_utils import ClipStore, open_clip_store
+from resource_utils import subprocess_slot, get_subprocess_threads, get_max_slots
+from shard_utils import in_shard, get_shard_filepath, get_shard_filepaths
 
 
 # define global constants
@@ -96,63 +105,138 @@ def create_manifest_for_pretrain(pretrain_path):
     return pd.DataFrame(df)
 
 
-def segment_video_and_text(in_path, out_path, info):
-    # set input and output files
-    vid_filename = info["fid"].split("_")[0]
+def get_pretrain_source_video(fid):
+    # long videos are divided into `{fid}_{i}` sentences
+    fid = Path(fid)
+    return str(fid.parent / fid.name.split("_")[0])
+
+
+def segment_video_and_text(in_path, out_path, ledger, stage, video_info):
+    """
+    Writes all the sentences of a source video, decoding it only once (once
+    per `--max-subprocesses` sentences): the decoded streams are split into
+    one trimmed & encoded output per sentence.
+    """
+    vid_filename, segments = video_info
     in_video_filepath = in_path / f"{vid_filename}.mp4"
-    out_video_filepath = out_path / f"{info['fid']}.mp4"
-    out_text_filepath = out_path / f"{info['fid']}.txt"
-    out_text_filepath.parent.mkdir(parents=True, exist_ok=True)
-    # write out text (if not found)
-    if not out_text_filepath.exists():
-        with open(out_text_filepath, "w") as fout:
-            fout.write(f"Text:  {info['sent']}\n")
-    # process video (if not already)
-    if not out_video_filepath.exists():
-        # check if video should be segmented
-        if info["end"] == VIDEO_END:
-            # video is short, copy it instead
-            shutil.copyfile(in_video_filepath, out_video_filepath)
-        else:
-            # segment video
-            in_video = ffmpeg.input(str(in_video_filepath))
-            trimmed_video = (
-                in_video
-                .trim(start=info["start"], end=info["end"])
-                .setpts('PTS-STARTPTS')
-            )
-            trimmed_audio = (
-                in_video
-                .filter_("atrim", start=info["start"], end=info["end"])
-                .filter_("asetpts", "PTS-STARTPTS")
-            )
-            out_video = ffmpeg.concat(trimmed_video, trimmed_audio, v=1, a=1).node
-            output = ffmpeg.output(
-                out_video[0],
-                out_video[1],
-                str(out_video_filepath),
-                vcodec="libx264",
-                loglevel="quiet",
+    (out_path / vid_filename).parent.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        trimmed_segments = []
+        for info in segments:
+            out_video_filepath = out_path / f"{info['fid']}.mp4"
+            out_text_filepath = out_path / f"{info['fid']}.txt"
+            # write out text
+            with atomic_output(out_text_filepath) as tmp_filepath:
+                with open(tmp_filepath, "w") as fout:
+                    fout.write(f"Text:  {info['sent']}\n")
+            tmp_filepath = stack.enter_context(atomic_output(out_video_filepath))
+            # check if video should be segmented
+            if info["end"] == VIDEO_END:
+                # video is short, copy it instead
+                shutil.copyfile(in_video_filepath, tmp_filepath)
+            else:
+                trimmed_segments.append((info, tmp_filepath))
+        # segment video, an ffmpeg run decodes it once for several outputs and
+        # holds a slot per output since each of them runs a libx264 encoder
+        group_size = get_max_slots()
+        for group_start in range(0, len(trimmed_segments), group_size):
+            group = trimmed_segments[group_start : group_start + group_size]
+            in_video = ffmpeg.input(
+                str(in_video_filepath), threads=get_subprocess_threads()
             )
-            output.run(overwrite_output=True)
+            num_outputs = len(group)
+            video_streams = in_video.video.filter_multi_output("split", num_outputs)
+            audio_streams = in_video.audio.filter_multi_output("asplit", num_outputs)
+            outputs = []
+            for i, (info, tmp_filepath) in enumerate(group):
+                trimmed_video = (
+                    video_streams[i]
+                    .trim(start=info["start"], end=info["end"])
+                    .setpts("PTS-STARTPTS")
+                )
+                trimmed_audio = (
+                    audio_streams[i]
+                    .filter_("atrim", start=info["start"], end=info["end"])
+                    .filter_("asetpts", "PTS-STARTPTS")
+                )
+                outputs.append(
+                    ffmpeg.output(
+                        trimmed_video,
+                        trimmed_audio,
+                        str(tmp_filepath),
+                        format="mp4",
+                        vcodec="libx264",
+                        threads=get_subprocess_threads(),
+                    )
+                )
+            with subprocess_slot(num_outputs):
+                (
+                    ffmpeg.merge_outputs(*outputs)
+                    .global_args("-loglevel", "quiet")
+                    .run(overwrite_output=True)
+                )
+    for info in segments:
+        ledger.mark(stage, info["fid"])
+
 
+def get_lrs3_shard_key(fid):
+    # all the segments of a source (YouTube) video go to the same shard
+    return fid.split("/")[0]
 
-def segment_pretrain_videos_and_text(lrs3_path):
+
+def segment_pretrain_videos_and_text(lrs3_path, ledger, governor, shard=None):
     seg_pretrain_path = lrs3_path / "seg_pretrain"
     seg_pretrain_path.mkdir(parents=True, exist_ok=True)
-    if len(list(seg_pretrain_path.rglob("*.mp4"))) == 268864:
+    stage = "lrs3_seg_pretrain"
+    if ledger.is_stage_done(stage):
         return # skip if all pretrain videos have already been segmented
 
     pretrain_path = lrs3_path / "pretrain"
     df = create_manifest_for_pretrain(pretrain_path)
+    # skip sentences that were segmented in a previous run
+    processed_fids = ledger.done_items(stage)
+    df = df[~df["fid"].isin(processed_fids)]
+    # a boolean mask (an empty list/object Series would select zero columns)
+    is_in_shard = df["fid"].map(lambda fid: in_shard(get_lrs3_shard_key(fid), shard))
+    df = df[is_in_shard.astype(bool)]
+    # group sentences by source video
+    df = df.assign(video=df["fid"].map(get_pretrain_source_video))
+    videos_info = [
+        (vid_filename, video_df.to_dict("records"))
+        for vid_filename, video_df in df.groupby("video", sort=False)
+    ]
+    # every source video is decoded whole, longest videos first; durations
+    # come from the mp4 headers (the sentence boundaries when unparsable)
+    durations = governor.map(
+        get_header_video_duration,
+        [pretrain_path / f"{vid_filename}.mp4" for vid_filename, _ in videos_info],
+        desc="Probing LRS3-pretrain",
+        io_bound=True,  # only reads the files' headers
+    )
+    video_lengths = [
+        duration
+        if duration is not None
+        else max(
+            info["start"] if info["end"] == VIDEO_END else info["end"]
+            for info in segments
+        )
+        for duration, (_, segments) in zip(durations, videos_info)
+    ]
+    videos_info = [
+        video_info
+        for _, video_info in sorted(
+            zip(video_lengths, videos_info), key=lambda x: x[0], reverse=True
+        )
+    ]
     print("\nStart segmenting LRS3 `pretrain` set to `seg_pretrain`")
-    process_map(
-        partial(segment_video_and_text, pretrain_path, seg_pretrain_path),
-        df.to_dict("records"),
-        max_workers=os.cpu_count(),
+    governor.map(
+        partial(
+            segment_video_and_text, pretrain_path, seg_pretrain_path, ledger, stage
+        ),
+        videos_info,
         desc="Segmenting LRs3-pretrain",
-        chunksize=1,
     )
+    ledger.mark_stage_done(stage)
 
 
 def load_lrs3_valid_ids(metadata_path):
@@ -166,18 +250,27 @@ def load_lrs3_valid_ids(metadata_path):
 
 
 def extract_audio_video_from_video(
-    mean_face_metadata, en_metadata_path, in_path, out_path, info
+    mean_face_metadata,
+    en_metadata_path,
+    in_path,
+    out_path,
+    ledger,
+    stage,
+    info,
+    video_store_path=None,
+    grayscale=False,
 ):
     in_split, out_split, fid = info
     # extract audio from video
     in_video_filepath = in_path / in_split / f"{fid}.mp4"
     out_audio_filepath = out_path / "audio" / out_split / f"{fid}.wav"
     out_audio_filepath.parent.mkdir(parents=True, exist_ok=True)
-    if not out_audio_filepath.exists():
+    with atomic_output(out_audio_filepath) as tmp_filepath, subprocess_slot():
         (
-            ffmpeg.input(str(in_video_filepath))
+            ffmpeg.input(str(in_video_filepath), threads=get_subprocess_threads())
             .output(
-                str(out_audio_filepath),
+                str(tmp_filepath),
+                format="wav",
                 acodec="pcm_s16le",
                 ac=1,
                 ar="16000",
@@ -187,18 +280,21 @@ def extract_audio_video_from_video(
         )
     # preprocess video
     out_video_filepath = out_path / "video" / out_split / f"{fid}.mp4"
-    out_video_filepath.parent.mkdir(parents=True, exist_ok=True)
-    if not out_video_filepath.exists():
-        out_fps = 25
-        # load landmark
-        metadata_filename, _, seg_id = fid.rpartition("/")
-        metadata_filepath = en_metadata_path / out_split / f"{metadata_filename}.pkl"
-        seg_metadata = load_video_metadata(metadata_filepath)[seg_id]
-        video_frames = split_video_to_frames(in_video_filepath)
-        # load input video
-        num_frames = min(
-            len(seg_metadata), round(get_video_duration(in_video_filepath) * out_fps)
-        )
+    if video_store_path is None:
+        out_video_filepath.parent.mkdir(parents=True, exist_ok=True)
+    out_fps = 25
+    # load landmark (zero-copy from the split's memory-mapped store), segments
+    # without landmarks are resized instead of cropped
+    seg_metadata = load_landmark_store(en_metadata_path / out_split).get(fid, [])
+    # probed once, the reader & the frame count share it
+    with subprocess_slot():
+        probe = probe_video_stream(in_video_filepath)
+    # frames are read into a ring buffer, `crop_patch` only holds a few of them
+    video_frames = FrameReader(in_video_filepath, grayscale=grayscale, probe=probe)
+    # load input video
+    num_frames = min(len(seg_metadata), round(get_probed_duration(probe) * out_fps))
+    # the decoder is closed (& its slot released) before the encoder starts
+    with closing(iter(video_frames)) as video_frames:
         if len(seg_metadata) > 0:
             frames = crop_patch(
                 video_frames,
@@ -209,13 +305,37 @@ def extract_audio_video_from_video(
             )
         else:
             frames = resize_frames(video_frames, new_size=(96, 96))
-        # save video
+    # save video (or append it to the split's raw clip store)
+    if video_store_path is None:
         save_video(frames, out_video_filepath, out_fps)
-
-
-def process_lrs3_videos(lrs3_path, metadata_path, muavic_path):
+    elif len(frames) > 0:
+        open_clip_store(video_store_path / out_split).write(fid, frames)
+    ledger.mark(stage, fid)
+
+
+def process_lrs3_videos(
+    lrs3_path,
+    metadata_path,
+    muavic_path,
+    ledger,
+    governor,
+    out_video_format="mp4",
+    grayscale=False,
+    shard=None,
+):
     mean_face_metadata = load_meanface_metadata(metadata_path)
+    video_store_path = None
+    if out_video_format == "raw":
+        video_store_path = muavic_path / "en" / "video_raw"
     for split in ["seg_pretrain", "trainval", "test"]:
+        stage = f"lrs3_av/{split}"
+        if out_video_format == "raw":
+            stage += "/raw"
+        if grayscale:
+            stage += "/gray"
+        if ledger.is_stage_done(stage):
+            continue # skip if all videos of this split have been processed
+        processed_fids = ledger.done_items(stage)
         fids = [
             str(filepaths.relative_to(lrs3_path / split))[:-4]  # removes .mp4
             for filepaths in (lrs3_path / split).rglob("*.mp4")
@@ -234,25 +354,57 @@ def process_lrs3_videos(lrs3_path, metadata_path, muavic_path):
             ]
         elif split == "test":
             fids = [(split, "test", id_) for id_ in fids]
+        fids = [
+            info
+            for info in fids
+            if info[-1] not in processed_fids
+            and in_shard(get_lrs3_shard_key(info[-1]), shard)
+        ]
+        # build the landmark stores once, before the workers open them
+        for out_split in {info[1] for info in fids}:
+            load_landmark_store(metadata_path / "en" / out_split)
         # start processing data
-        process_map(
+        governor.map(
             partial(
                 extract_audio_video_from_video,
                 mean_face_metadata,
                 metadata_path / "en",
                 lrs3_path,
                 muavic_path / "en",
+                ledger,
+                stage,
+                video_store_path=video_store_path,
+                grayscale=grayscale,
             ),
             fids,
-            max_workers=os.cpu_count(),
             desc=f"Processing LRS3/{split}",
-            chunksize=1,
         )
+        ledger.mark_stage_done(stage)
+
+
+def get_lrs3_avsr_filepaths(muavic_path, split, shard=None):
+    """Returns the transcription & manifest files of `split` (or of a shard)"""
+    filepaths = (
+        muavic_path / "en" / f"{split}.en",
+        muavic_path / "en" / f"{split}.tsv",
+    )
+    if shard is None:
+        return filepaths
+    return tuple(get_shard_filepath(filepath, shard) for filepath in filepaths)
 
 
-def prepare_lrs3_avsr_manifests(lrs3_path, muavic_path):
+def prepare_lrs3_avsr_manifests(
+    lrs3_path, muavic_path, governor, out_video_format="mp4", shard=None
+):
+    """
+    Writes the AVSR manifests & transcriptions. A shard only writes the ones
+    of its source videos, see `merge_lrs3_avsr_manifests()`.
+    """
     # gather LRS3 textual data if transcription files haven't been written
-    if len(list((muavic_path / "en").glob("*.en"))) != 3:
+    if not all(
+        get_lrs3_avsr_filepaths(muavic_path, split, shard)[0].exists()
+        for split in SPLITS
+    ):
         fid_to_text = {}
         for split in ["seg_pretrain", "trainval", "test"]:
             if split == "seg_pretrain":
@@ -266,7 +418,10 @@ def prepare_lrs3_avsr_manifests(lrs3_path, muavic_path):
 
     for split in SPLITS:
         # create transcription manifest
-        transcription_filepath = muavic_path / "en" / f"{split}.en"
+        transcription_filepath, manifest_filepath = get_lrs3_avsr_filepaths(
+            muavic_path, split, shard
+        )
+        transcription_filepath.parent.mkdir(parents=True, exist_ok=True)
         if not transcription_filepath.exists():
             if split == "train":
                 print(f"\nCreating AVSR manifests for `en`")
@@ -275,87 +430,151 @@ def prepare_lrs3_avsr_manifests(lrs3_path, muavic_path):
                 str(filepath.relative_to(muavic_path / "en" / "audio" / split))[:-4]
                 for filepath in (muavic_path / "en" / "audio" / split).rglob("*.wav")
             ]
+            fids = [fid for fid in fids if in_shard(get_lrs3_shard_key(fid), shard)]
             transcriptions = [
                 fid_to_text[fid]
                 for fid in tqdm(fids, desc=f"en/{split} AVSR transcriptions")
             ]
             write_txt_file(transcriptions, transcription_filepath)
         # create AVSR manifest
-        manifest_filepath = muavic_path / "en" / f"{split}.tsv"
         if not manifest_filepath.exists():
             audio_datapath = muavic_path / "en" / "audio" / split
             video_datapath = muavic_path / "en" / "video" / split
+            video_store = None
+            if out_video_format == "raw":
+                video_store = ClipStore(muavic_path / "en" / "video_raw" / split)
             av_manifest_df = pd.DataFrame(
-                process_map(
-                    partial(get_audio_video_info, audio_datapath, video_datapath),
+                governor.map(
+                    partial(
+                        get_audio_video_info,
+                        audio_datapath,
+                        video_datapath,
+                        video_store=video_store,
+                    ),
                     fids,
                     desc=f"en/{split} AVSR manifest",
-                    max_workers=os.cpu_count(),
-                    chunksize=1,
-                )
+                    io_bound=True,  # only reads the files' headers
+                ),
+                columns=MANIFEST_COLUMNS,  # a shard may have no fileids
             )
             # write down the manifest TSV file
             write_av_manifest(av_manifest_df, manifest_filepath)
 
 
+def iter_tmx_pairs(tmx_filepath):
+    """
+    Incrementally parses a compressed tmx file and yields the segments of
+    every translation unit, in the order they appear in the file.
+    """
+    with GzipFile(tmx_filepath) as fin:
+        body = None
+        for event, elem in ElementTree.iterparse(fin, events=("start", "end")):
+            if event == "start":
+                if elem.tag == "body":
+                    body = elem
+            elif elem.tag == "tu":
+                yield tuple(
+                    "".join(seg.itertext()).strip() for seg in elem.iter("seg")
+                )
+                # drop parsed translation units to keep memory bounded
+                body.clear()
+
+
 def extract_ted2020_data(tgz_filepath, src, tgt, out_path):
     """
     Parses a compressed tmx file and writes the data into a TSV file.
     """
-    # parse compressed file
-    tmx_dict = xmltodict.parse(GzipFile(tgz_filepath))
-    # extract parallel sentences
     lang_pair = f"{src}-{tgt}"
-    src_sents, tgt_sents = [], []
-    for tu in tqdm(tmx_dict["tmx"]["body"]["tu"], desc=f"Extracting {lang_pair}"):
-        src_sents.append(tu["tuv"][0]["seg"])
-        tgt_sents.append(tu["tuv"][1]["seg"])
-    # write files
     out_tsv = out_path / f"{lang_pair}.tsv"
     # NOTE: TED2020 orders languages alphabetically (src < tgt)
     if src > tgt:
         src, tgt = tgt, src
-    pd.DataFrame(
-        {
-            src: src_sents,
-            tgt: tgt_sents,
-        }
-    ).drop_duplicates().dropna().to_csv(out_tsv, sep="\t", index=False)
+    seen_pairs = set()
+    with atomic_output(out_tsv) as tmp_tsv, open(tmp_tsv, "w", newline="") as fout:
+        writer = csv.writer(fout, delimiter="\t", lineterminator="\n")
+        writer.writerow([src, tgt])
+        for segs in iter_tmx_pairs(tgz_filepath):
+            # skip incomplete & duplicate pairs
+            if len(segs) < 2 or not all(segs[:2]):
+                continue
+            # the pair itself is kept, hashes could collide & drop pairs
+            pair = tuple(segs[:2])
+            if pair not in seen_pairs:
+                seen_pairs.add(pair)
+                writer.writerow(pair)
+
+
+def merge_lrs3_avsr_manifests(muavic_path, num_shards):
+    """
+    Builds the AVSR manifests & transcriptions by concatenating the ones
+    written by `num_shards` shards. Media files aren't read again.
+    """
+    for split in SPLITS:
+        transcription_filepath, manifest_filepath = get_lrs3_avsr_filepaths(
+            muavic_path, split
+        )
+        if transcription_filepath.exists() and manifest_filepath.exists():
+            continue
+        transcriptions = [
+            ln
+            for shard_filepath in get_shard_filepaths(
+                transcription_filepath, num_shards
+            )
+            for ln in read_txt_file(shard_filepath)
+        ]
+        av_manifest_df = pd.concat(
+            [
+                read_av_manifest(shard_filepath)
+                for shard_filepath in get_shard_filepaths(
+                    manifest_filepath, num_shards
+                )
+            ]
+        )
+        assert len(transcriptions) == len(av_manifest_df), "Shards don't match!!"
+        write_txt_file(transcriptions, transcription_filepath)
+        write_av_manifest(av_manifest_df, manifest_filepath)
 
 
-def download_ted2020(ted2020_path):
+def download_ted2020(ted2020_path, governor):
     # download TED2020 for target languages
-    for lang in TARGET_LANGS:
-        # download & extract TED2020 data if not
-        if not (ted2020_path / f"en-{lang}.tsv").exists():
-            tgz_filename = (
-                f"{lang}-en.tmx.gz" if lang < "en" else f"en-{lang}.tmx.gz"
+    pending_langs = [
+        lang
+        for lang in TARGET_LANGS
+        if not (ted2020_path / f"en-{lang}.tsv").exists()
+    ]
+    tgz_filepaths = []
+    for lang in pending_langs:
+        # download TED2020 data if not
+        tgz_filename = f"{lang}-en.tmx.gz" if lang < "en" else f"en-{lang}.tmx.gz"
+        tgz_filepath = ted2020_path / tgz_filename
+        if not tgz_filepath.exists():
+            # download file
+            download_file(
+                f"https://opus.nlpl.eu/download.php?f=TED2020/v1/tmx/{tgz_filename}",
+                ted2020_path,
             )
-            tgz_filepath = ted2020_path / tgz_filename
-            if not tgz_filepath.exists():
-                # download file
-                download_file(
-                    f"https://opus.nlpl.eu/download.php?f=TED2020/v1/tmx/{tgz_filename}",
-                    ted2020_path,
-                )
-            # extract file
-            extract_ted2020_data(tgz_filepath, "en", lang, ted2020_path)
+        tgz_filepaths.append(tgz_filepath)
+    if pending_langs:
+        # extract language pairs in parallel
+        governor.map(
+            extract_ted2020_data,
+            tgz_filepaths,
+            repeat("en", len(pending_langs)),
+            pending_langs,
+            repeat(ted2020_path, len(pending_langs)),
+            max_workers=len(pending_langs),
+            desc="Extracting TED2020",
+        )
 
 
 def segment_ted2020_sents(src_sents, tgt_sents):
     assert len(src_sents) == len(tgt_sents)
-    # regex to represent end-of-sentence
-    SENT_END_REGEX = re.compile(
-        r"(?<=(?<!Mr)(?<!Mrs)(?<!Ms)(?<!Dr)(?<!Jr)[.!,?؟،])\s{1,2}"
-    )  # src: https://ideone.com/25TUP2
-    # create punctuation segmenter
-    segmenter = lambda x: SENT_END_REGEX.split(x)
     # iterate over src/tgt sentences
     segmented_src_sents, segmented_tgt_sents = [], []
     for src_s, tgt_s in zip(src_sents, tgt_sents):
         # try to split sentences into smaller segments
-        src_segments = segmenter(src_s)
-        tgt_segments = segmenter(tgt_s)
+        src_segments = split_sents(src_s)
+        tgt_segments = split_sents(tgt_s)
         # only add them if we got same number of segments
         if len(src_segments) == len(tgt_segments):
             segmented_src_sents.extend(src_segments)
@@ -369,114 +588,158 @@ def segment_ted2020_sents(src_sents, tgt_sents):
     return segmented_src_sents, segmented_tgt_sents
 
 
-def prepare_lrs3_avst_manifests(mt_trans_path, ted2020_path, muavic_path):
+def build_ted2020_index(ted2020_path, lang):
+    """
+    Returns {normalized English segment: `lang` segment} of TED2020, keeping
+    the first translation of every English segment. It's cached on disk next
+    to the TED2020 data, so segmenting & normalizing only happens once.
+    """
+    index_filepath = ted2020_path / f"en-{lang}.index.pkl"
+    if index_filepath.exists():
+        with open(index_filepath, "rb") as fin:
+            return pickle.load(fin)
+    ted2020_df = pd.read_csv(ted2020_path / f"en-{lang}.tsv", sep="\t").dropna()
+    # segment ted2020 sentences
+    seg_en_sents, seg_lang_sents = segment_ted2020_sents(
+        ted2020_df["en"].tolist(), ted2020_df[lang].tolist()
+    )
+    human_trans = {}
+    for en_sent, lang_sent in zip(normalize_texts(seg_en_sents), seg_lang_sents):
+        human_trans.setdefault(en_sent, lang_sent)
+    with atomic_output(index_filepath) as tmp_filepath:
+        with open(tmp_filepath, "wb") as fout:
+            pickle.dump(human_trans, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    return human_trans
+
+
+def get_lrs3_en_index_filepath(mt_trans_path, split):
+    return mt_trans_path / "en-x" / f"{split}.index.pkl"
+
+
+def build_lrs3_en_index(mt_trans_path, muavic_path, split, governor=None):
+    """
+    Writes the normalized English text of every row of the `split` AVSR
+    manifest, which all target languages look up their translations with:
+    the English of its pseudo-translation (& the pseudo-translation's line
+    number) for "train" & "valid", the transcription for "test".
+    """
+    index_filepath = get_lrs3_en_index_filepath(mt_trans_path, split)
+    if index_filepath.exists():
+        return
+    manifest_ids = load_manifest(muavic_path / "en" / f"{split}.tsv")["id"].tolist()
+    if split != "test":
+        # remove split from id (e.g `test/x/xx_0`` -> `x/xx_0`)
+        id_to_idx = {
+            id_.partition("/")[-1]: idx
+            for idx, id_ in enumerate(
+                read_txt_file(mt_trans_path / "en-x" / f"{split}_id.txt")
+            )
+        }
+        assert all(
+            id_ in id_to_idx for id_ in manifest_ids
+        ), "Adding pseudo translation to AVSR manifest was wrong!!"
+        pseudo_indices = [id_to_idx[id_] for id_ in manifest_ids]
+        pseudo_en_sents = list(read_txt_file(mt_trans_path / "en-x" / f"{split}.en"))
+        en_sents = normalize_texts(
+            (pseudo_en_sents[idx] for idx in pseudo_indices), governor
+        )
+    else:
+        pseudo_indices = None
+        en_sents = normalize_texts(
+            read_txt_file(muavic_path / "en" / "test.en"), governor
+        )
+        assert len(en_sents) == len(
+            manifest_ids
+        ), "English transcriptions don't match the AVSR manifest!!"
+    with atomic_output(index_filepath) as tmp_filepath:
+        with open(tmp_filepath, "wb") as fout:
+            pickle.dump(
+                {"en": en_sents, "pseudo_indices": pseudo_indices},
+                fout,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+
+
+def get_lrs3_avst_filepaths(muavic_path, lang, split):
+    """Returns the translation & manifest files of `split`"""
+    return (
+        muavic_path / "en" / lang / f"{split}.{lang}",
+        muavic_path / "en" / lang / f"{split}.tsv",
+    )
+
+
+def prepare_lrs3_avst_lang_manifests(mt_trans_path, ted2020_path, muavic_path, lang):
+    """
+    Writes the `en-{lang}` AVST manifests & translations by streaming over
+    the English of every AVSR manifest row (see `build_lrs3_en_index()`) and
+    looking up its human translation in the TED2020 index.
+    """
+    human_trans = None
+    for split in SPLITS:
+        out_tgt_filepath, out_manifest_filepath = get_lrs3_avst_filepaths(
+            muavic_path, lang, split
+        )
+        out_tgt_filepath.parent.mkdir(parents=True, exist_ok=True)
+        if out_tgt_filepath.exists():
+            continue
+        if human_trans is None:
+            human_trans = build_ted2020_index(ted2020_path, lang)
+        with open(get_lrs3_en_index_filepath(mt_trans_path, split), "rb") as fin:
+            en_index = pickle.load(fin)
+        # AVST manifest is the AVSR one or a subset of it
+        manifest_filepath = muavic_path / "en" / f"{split}.tsv"
+        # combine human translation with MT translation for "train" & "valid"
+        if split != "test":
+            pseudo_trans = list(
+                read_txt_file(mt_trans_path / "en-x" / f"{split}.{lang}")
+            )
+            translations = [
+                human_trans.get(en_sent, pseudo_trans[idx])
+                for en_sent, idx in zip(en_index["en"], en_index["pseudo_indices"])
+            ]
+            shutil.copyfile(src=manifest_filepath, dst=out_manifest_filepath)
+        # use only human translation for "test"
+        else:
+            matched_indices = [
+                idx
+                for idx, en_sent in enumerate(en_index["en"])
+                if en_sent in human_trans
+            ]
+            translations = [
+                human_trans[en_index["en"][idx]] for idx in matched_indices
+            ]
+            manifest_df = read_av_manifest(manifest_filepath)
+            write_av_manifest(manifest_df.iloc[matched_indices], out_manifest_filepath)
+        # the translations are written last, they mark the split as done
+        write_txt_file(translations, out_tgt_filepath)
+
+
+def prepare_lrs3_avst_manifests(mt_trans_path, ted2020_path, muavic_path, governor):
     # download & extract pseudo-translation if that wasn't done already
     tgz_filename = "en-x.tgz"
     tgz_filepath = mt_trans_path / tgz_filename
     url = f"https://dl.fbaipublicfiles.com/muavic/mt_trans/{tgz_filename}"
-    download_extract_file_if_not(url, tgz_filepath, "en-x")
+    download_extract_file_if_not(url, tgz_filepath)
+    pending_langs = [
+        lang
+        for lang in TARGET_LANGS
+        if not all(
+            get_lrs3_avst_filepaths(muavic_path, lang, split)[0].exists()
+            for split in SPLITS
+        )
+    ]
+    if not pending_langs:
+        return
     # start generating output translation files
     print(f"\nCreating AVST manifests")
-    for lang in TARGET_LANGS:
-        # load human translations from TED2020 dataset
-        ted2020_df = pd.read_csv(ted2020_path / f"en-{lang}.tsv", sep="\t").dropna()
-        # segment ted2020 sentences
-        seg_en_sents, seg_lang_sents = segment_ted2020_sents(
-            ted2020_df["en"].tolist(), ted2020_df[lang].tolist()
-        )
-        # use segmented translations (after normalization) as human translations
-        human_trans = pd.DataFrame(
-            {
-                "en": [normalize_text(sent) for sent in seg_en_sents],
-                lang: seg_lang_sents,
-            }
-        )
-        for split in tqdm(SPLITS, desc=f"en-{lang} AVST manifest"):
-            # set output files
-            out_tgt_filepath = muavic_path / "en" / lang / f"{split}.{lang}"
-            out_manifest_filepath = muavic_path / "en" / lang / f"{split}.tsv"
-            out_tgt_filepath.parent.mkdir(parents=True, exist_ok=True)
-            if not out_tgt_filepath.exists():
-                # load AVSR manifest (AVST manifest is usually a subset)
-                manifest_df = read_av_manifest(muavic_path / "en" / f"{split}.tsv")
-                # combine human translation with MT translation for "train" & "valid"
-                if split != "test":
-                    # load pseudo-translation
-                    split_ids = read_txt_file(
-                        mt_trans_path / "en-x" / f"{split}_id.txt"
-                    )
-                    # remove split from id (e.g `test/x/xx_0`` -> `x/xx_0`)
-                    split_ids = [id_.partition("/")[-1] for id_ in split_ids]
-                    pseudo_trans = pd.DataFrame(
-                        {
-                            "id": split_ids,
-                            "en": [
-                                normalize_text(ln)
-                                for ln in read_txt_file(
-                                    mt_trans_path / "en-x" / f"{split}.en"
-                                )
-                            ],
-                            lang: read_txt_file(
-                                mt_trans_path / "en-x" / f"{split}.{lang}"
-                            ),
-                        }
-                    ).set_index("id")
-                    # add pseudo translation to manifest
-                    pseudo_trans = pd.merge(
-                        manifest_df, pseudo_trans, on="id", how="inner"
-                    )
-                    assert len(pseudo_trans) == len(
-                        manifest_df
-                    ), "Adding pseudo translation to AVSR manifest was wrong!!"
-
-                    # merge using the English text
-                    ### 1. get the matched indices
-                    merged_trans = pd.merge(
-                        left=pseudo_trans,
-                        right=human_trans.drop_duplicates(subset=["en"]),
-                        on="en",
-                        how="left",
-                    ).set_index(pseudo_trans.index)
-                    assert len(merged_trans) == len(
-                        pseudo_trans
-                    ), "Mismatch between pseudo and human translation!!"
-                    matched_indices = merged_trans[
-                        merged_trans[f"{lang}_y"].notna()
-                    ].index
-
-                    ### 2. replace these indices with true translations
-                    pseudo_trans.loc[matched_indices][lang] = merged_trans.loc[
-                        matched_indices
-                    ][f"{lang}_y"].values
-                    assert len(pseudo_trans.dropna()) == len(
-                        pseudo_trans
-                    ), "Merging true translations with ids caused N/A values!!"
-
-                    ### 3. write out the results
-                    write_txt_file(pseudo_trans[lang].tolist(), out_tgt_filepath)
-                    pseudo_trans.drop(["en", lang], axis=1, inplace=True)
-                    write_av_manifest(pseudo_trans, out_manifest_filepath)
-
-                # use only human translation for "test"
-                else:
-                    # add English transcriptions
-                    manifest_df["en"] = [
-                        normalize_text(ln)
-                        for ln in read_txt_file(muavic_path / "en" / f"test.en")
-                    ]
-                    merged_trans = pd.merge(
-                        left=manifest_df,
-                        right=human_trans.drop_duplicates(subset=["en"]),
-                        on="en",
-                        how="left",
-                    ).set_index(manifest_df.index)
-                    assert len(merged_trans) == len(
-                        manifest_df
-                    ), "Mismatch between pseudo and human translation!!"
-                    # select only the found matches
-                    matched_indices = merged_trans[merged_trans[lang].notna()].index
-                    merged_trans = merged_trans.loc[matched_indices]
-                    # write out the results
-                    write_txt_file(merged_trans[lang].tolist(), out_tgt_filepath)
-                    merged_trans.drop(["en", lang], axis=1, inplace=True)
-                    write_av_manifest(merged_trans, out_manifest_filepath)
+    # the English side is normalized once & shared by all languages
+    for split in SPLITS:
+        build_lrs3_en_index(mt_trans_path, muavic_path, split, governor)
+    governor.map(
+        partial(
+            prepare_lrs3_avst_lang_manifests, mt_trans_path, ted2020_path, muavic_path
+        ),
+        pending_langs,
+        max_workers=len(pending_langs),
+        desc="en-X AVST manifests",
+    )
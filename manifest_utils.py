@@ -0,0 +1,254 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from ledger_utils import atomic_output
+
+
+MANIFEST_ROOT = "/"
+# size of the TSV blocks hashed into the signature of its index
+SIGNATURE_BLOCK_SIZE = 1 << 16
+STRING_COLUMNS = ["id", "video", "audio"]
+COUNT_COLUMNS = ["video_frames", "audio_samples"]
+MANIFEST_COLUMNS = STRING_COLUMNS + COUNT_COLUMNS
+
+
+class StringColumn:
+    """
+    Strings stored as their "\\n"-joined utf-8 bytes plus the offset of each
+    one (like Arrow string arrays), so they can be memory-mapped. Strings are
+    only decoded when accessed.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @staticmethod
+    def from_strings(strings):
+        if not strings:
+            return StringColumn(np.empty(0, np.uint8), np.zeros(1, np.int64))
+        data = np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+        # every string starts right after the previous separator
+        offsets = np.empty(len(strings) + 1, dtype=np.int64)
+        offsets[0] = 0
+        offsets[1:-1] = np.flatnonzero(data == ord("\n")) + 1
+        offsets[-1] = len(data) + 1
+        return StringColumn(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1] - 1
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        if len(self) == 0:
+            return []
+        # a single decode & split is much faster than decoding every string
+        return self.data.tobytes().decode("utf-8").split("\n")
+
+
+class Manifest:
+    """
+    Columns of an AVSR/AVST manifest: `StringColumn`s for ids & paths and
+    int64 arrays for frame/sample counts (memory-mapped when loaded from an
+    index, see `load_manifest()`).
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @staticmethod
+    def from_columns(columns):
+        """Builds a manifest from lists of strings & integer sequences"""
+        return Manifest(
+            {
+                col: (
+                    StringColumn.from_strings(columns[col])
+                    if col in STRING_COLUMNS
+                    else np.asarray(columns[col], dtype=np.int64)
+                )
+                for col in MANIFEST_COLUMNS
+            }
+        )
+
+    @staticmethod
+    def from_dataframe(df):
+        return Manifest.from_columns(
+            {
+                col: df[col].astype(str).tolist() if col in STRING_COLUMNS else df[col]
+                for col in MANIFEST_COLUMNS
+            }
+        )
+
+    def to_dataframe(self):
+        return pd.DataFrame(
+            {
+                col: (
+                    self.columns[col].tolist()
+                    if col in STRING_COLUMNS
+                    else np.asarray(self.columns[col])
+                )
+                for col in MANIFEST_COLUMNS
+            }
+        )
+
+
+def read_manifest_columns(tsv_filepath):
+    """
+    Parses a manifest TSV into {column: values}, counts as int64 arrays. The
+    whole file is split at once and columns are strided slices of the fields,
+    which is faster than `pd.read_csv` on these all-string rows.
+    """
+    with open(tsv_filepath) as fin:
+        fin.readline()  # root directory
+        fields = fin.read().replace("\n", "\t").split("\t")
+    if fields[-1] == "":
+        fields.pop()  # trailing newline
+    num_columns = len(MANIFEST_COLUMNS)
+    if len(fields) % num_columns != 0:
+        raise ValueError(f"`{tsv_filepath}` doesn't have {num_columns} columns!!")
+    columns = {
+        col: fields[i::num_columns] for i, col in enumerate(MANIFEST_COLUMNS)
+    }
+    for col in COUNT_COLUMNS:
+        columns[col] = np.array(columns[col], dtype=np.int64)
+    return columns
+
+
+def read_manifest_tsv(tsv_filepath):
+    return pd.DataFrame(read_manifest_columns(tsv_filepath), columns=MANIFEST_COLUMNS)
+
+
+def write_manifest_tsv(df, out_filepath):
+    if df.empty:
+        # e.g. a shard without samples, whose DataFrame has no columns either
+        df = df.reindex(columns=MANIFEST_COLUMNS)
+    columns = [df[col].astype(str).tolist() for col in MANIFEST_COLUMNS]
+    with atomic_output(out_filepath) as tmp_filepath:
+        with open(tmp_filepath, "w") as fout:
+            fout.write(f"{MANIFEST_ROOT}\n")
+            fout.writelines(f"{ln}\n" for ln in map("\t".join, zip(*columns)))
+
+
+def get_index_path(tsv_filepath):
+    return tsv_filepath.with_name(f"{tsv_filepath.name}.index")
+
+
+def get_tsv_signature(tsv_filepath):
+    """
+    Identifies the TSV's content by its inode, mtime & size plus a digest of
+    its first & last blocks, which catches in-place rewrites of the same size
+    within the mtime granularity of the file system.
+    """
+    stat = os.stat(tsv_filepath)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(tsv_filepath, "rb") as fin:
+        digest.update(fin.read(SIGNATURE_BLOCK_SIZE))
+        if stat.st_size > SIGNATURE_BLOCK_SIZE:
+            fin.seek(max(SIGNATURE_BLOCK_SIZE, stat.st_size - SIGNATURE_BLOCK_SIZE))
+            digest.update(fin.read(SIGNATURE_BLOCK_SIZE))
+    return {
+        "ino": stat.st_ino,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "digest": digest.hexdigest(),
+    }
+
+
+def write_manifest_index(manifest, tsv_filepath):
+    """
+    Caches the columns of `manifest` next to `tsv_filepath` as raw `.npy`
+    files. The index is keyed by the TSV's signature, so it's ignored
+    (and rebuilt) once the TSV changes.
+    """
+    index_path = get_index_path(tsv_filepath)
+    index_path.mkdir(exist_ok=True)
+    for col in MANIFEST_COLUMNS:
+        arrays = (
+            {"data": manifest[col].data, "offsets": manifest[col].offsets}
+            if col in STRING_COLUMNS
+            else {"data": manifest[col]}
+        )
+        for name, array in arrays.items():
+            with atomic_output(index_path / f"{col}.{name}.npy") as tmp_filepath:
+                with open(tmp_filepath, "wb") as fout:
+                    np.save(fout, np.ascontiguousarray(array))
+    # the signature is written last, it marks the index as complete
+    with atomic_output(index_path / "signature.json") as tmp_filepath:
+        with open(tmp_filepath, "w") as fout:
+            json.dump(get_tsv_signature(tsv_filepath), fout)
+
+
+def read_manifest_index(tsv_filepath, mmap=True):
+    """Returns the cached `Manifest` of `tsv_filepath`, None if stale/missing"""
+    index_path = get_index_path(tsv_filepath)
+    try:
+        with open(index_path / "signature.json") as fin:
+            if json.load(fin) != get_tsv_signature(tsv_filepath):
+                return None
+        mmap_mode = "r" if mmap else None
+        load = lambda name: np.load(index_path / f"{name}.npy", mmap_mode=mmap_mode)
+        columns = {
+            col: StringColumn(load(f"{col}.data"), load(f"{col}.offsets"))
+            for col in STRING_COLUMNS
+        }
+        columns.update({col: load(f"{col}.data") for col in COUNT_COLUMNS})
+    except (FileNotFoundError, ValueError):
+        return None
+    return Manifest(columns)
+
+
+def load_manifest(tsv_filepath, mmap=True, use_index=True):
+    """
+    Loads a manifest from its index when it's up to date, otherwise parses
+    the TSV and (re)builds the index for the next time.
+    """
+    tsv_filepath = Path(tsv_filepath)
+    if use_index:
+        manifest = read_manifest_index(tsv_filepath, mmap)
+        if manifest is not None:
+            return manifest
+    manifest = Manifest.from_columns(read_manifest_columns(tsv_filepath))
+    if use_index:
+        try:
+            write_manifest_index(manifest, tsv_filepath)
+        except OSError:
+            pass  # e.g. read-only dataset directory
+    return manifest
+
+
+def read_manifest(tsv_filepath, use_index=True):
+    """Returns the manifest as a DataFrame (see `load_manifest()`)"""
+    if not use_index:
+        return read_manifest_tsv(tsv_filepath)
+    return load_manifest(tsv_filepath).to_dataframe()
+
+
+def write_manifest(df, out_filepath, write_index=False):
+    """Writes the manifest columns of `df` as a TSV (& optionally its index)"""
+    out_filepath = Path(out_filepath)
+    if df.empty:
+        df = df.reindex(columns=MANIFEST_COLUMNS)
+    write_manifest_tsv(df, out_filepath)
+    if write_index:
+        write_manifest_index(Manifest.from_dataframe(df), out_filepath)
@@ -4,17 +4,22 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 import os
-import cv2
+import re
 import sox
+import wave
 import shutil
-import tempfile
 import warnings
 import pandas as pd
 from functools import partial
 from collections import defaultdict, OrderedDict
-from tqdm.contrib.concurrent import process_map
 
 from utils import *
+from landmark_utils import load_landmark_store
+from manifest_utils import MANIFEST_COLUMNS
+from clip_store_utils import ClipStore, open_clip_store
+from resource_utils import subprocess_slot
+from shard_utils import in_shard, get_shard_filepath, get_shard_filepaths
+from download_utils import DownloadScheduler, YouTubeDownloader, HttpDownloader
 
 
 # define global constants
@@ -24,116 +29,150 @@ SPLITS = ["train", "valid", "test"]
 def download_mtedx_data(download_path, src, tgt):
     """Downloads mTEDx data from OpenSLR"""
     tgz_filename = f"mtedx_{src}-{tgt}.tgz" if src != tgt else f"mtedx_{src}.tgz"
+    # audio is only needed from the transcription archive, translation
+    # archives are used for their text
+    members_regex = re.compile(
+        rf"(\./)?{src}-{tgt}/data/[^/]+/{'(wav|txt)' if src == tgt else 'txt'}/"
+    )
     download_extract_file_if_not(
         url=f"https://www.openslr.org/resources/100/{tgz_filename}",
         tgz_filepath=download_path / tgz_filename,
-        download_filename=f"{src}-{tgt}"
+        include=lambda name: members_regex.match(name) is not None,
     )
 
 
-def download_mtedx_lang_videos(mtedx_path, src_lang):
-    # keep track of non-found videos on YouTube
+def download_mtedx_lang_videos(
+    mtedx_path, src_lang, ledger, scheduler=None, metadata_path=None, shard=None
+):
+    if scheduler is None:
+        scheduler = DownloadScheduler(YouTubeDownloader(), ledger)
+    # keep track of non-found videos on YouTube (per shard, merged later)
+    not_found_filepath = mtedx_path / "not_found_videos.txt"
+    if shard is not None:
+        not_found_filepath = get_shard_filepath(not_found_filepath, shard)
+        not_found_filepath.parent.mkdir(parents=True, exist_ok=True)
     try:
-        not_found_videos = set(read_txt_file(mtedx_path / "not_found_videos.txt"))
+        not_found_videos = set(read_txt_file(not_found_filepath))
     except FileNotFoundError:
         not_found_videos = set()
     # get files id per split
     for split in SPLITS:
         out_path = mtedx_path / "video" / src_lang / split
         out_path.mkdir(parents=True, exist_ok=True)
-        if is_empty(out_path): #TODO: better check
-            if split == "train":
-                print(f"\nDownloading {src_lang} videos from YouTube")
-            # get youtube-ids from audio filenames inside `wav` directory
-            wav_dir_path = (
-                mtedx_path / f"{src_lang}-{src_lang}" / "data" / split / "wav"
-            )
-            yt_ids = [wav_filepath.stem for wav_filepath in wav_dir_path.glob("*")]
-            
-            # --- HACK FOR INTEGRATION TESTING ---
-            # Limit to 10 videos (approx 1.5 - 2.5 hours total)
-            # This ensures we get enough for >1hr clean data without downloading 200GB.
-            if len(yt_ids) > 10:
-                print(f"⚠️ LIMITING DOWNLOAD TO 10 VIDEOS FOR TESTING (Original: {len(yt_ids)})")
-                yt_ids = yt_ids[:10]
-            # -------------------------------------
-
-            # download videos from YouTube
-            downloading_status = process_map(
-                partial(download_video_from_youtube, out_path),
-                yt_ids,
-                max_workers=os.cpu_count(),
-                desc=f"Downloading {src_lang}/{split} Videos",
-                chunksize=1,
-            )
-            assert len(yt_ids) == len(downloading_status)
-            for yt_id, downloaded in zip(yt_ids, downloading_status):
-                if not downloaded:
-                    not_found_videos.add(yt_id)
-    with open(mtedx_path / "not_found_videos.txt", "w") as fout:
+        # get youtube-ids from audio filenames inside `wav` directory
+        wav_dir_path = mtedx_path / f"{src_lang}-{src_lang}" / "data" / split / "wav"
+        yt_ids = sorted(wav_filepath.stem for wav_filepath in wav_dir_path.glob("*"))
+
+        # --- HACK FOR INTEGRATION TESTING ---
+        # Limit to 10 videos (approx 1.5 - 2.5 hours total)
+        # This ensures we get enough for >1hr clean data without downloading 200GB.
+        if len(yt_ids) > 10:
+            print(f"⚠️ LIMITING DOWNLOAD TO 10 VIDEOS FOR TESTING (Original: {len(yt_ids)})")
+            yt_ids = yt_ids[:10]
+        # -------------------------------------
+        yt_ids = [yt_id for yt_id in yt_ids if in_shard(yt_id, shard)]
+
+        # face sizes let the downloader pick the lowest sufficient resolution,
+        # landmark extents let it check the resolution the landmarks belong to
+        face_sizes, landmark_extents = None, None
+        if metadata_path is not None:
+            split_metadata_path = metadata_path / src_lang / split
+            face_sizes, landmark_extents = {}, {}
+            for yt_id in yt_ids:
+                video_metadata = load_video_metadata(
+                    split_metadata_path / f"{yt_id}.pkl"
+                )
+                face_sizes[yt_id] = get_video_face_size(video_metadata)
+                landmark_extents[yt_id] = get_video_landmark_extent(video_metadata)
+        # download videos (skips the ones handled in previous runs)
+        if split == "train":
+            print(f"\nDownloading {src_lang} videos from YouTube")
+        downloading_status = scheduler.run(
+            yt_ids,
+            out_path,
+            stage=f"mtedx_download/{src_lang}/{split}",
+            desc=f"Downloading {src_lang}/{split} Videos",
+            face_sizes=face_sizes,
+            landmark_extents=landmark_extents,
+        )
+        for yt_id, status in downloading_status.items():
+            if status == "not_found":
+                not_found_videos.add(yt_id)
+            elif status == "failed":
+                warnings.warn(
+                    f"Downloading `{yt_id}` failed... it will be retried next run!!"
+                )
+    with open(not_found_filepath, "w") as fout:
         fout.writelines([f"{id_}\n" for id_ in not_found_videos])
 
 
-def segment_normalize_audio_file(out_dir, in_file_info):
+def segment_normalize_audio_file(out_dir, ledger, stage, talk_info):
     out_sr = 16_000
     out_channels = 1
     out_format = "wav"
-    in_filepath, fid, seg_id, start_sec, end_sec = in_file_info
-    out_filepath = out_dir / fid / f"{seg_id}.{out_format}"
-    if not in_filepath.exists() or out_filepath.exists():
+    in_filepath, fid, segments = talk_info
+    if not in_filepath.exists():
         return
-    out_filepath.parent.mkdir(parents=True, exist_ok=True)
+    (out_dir / fid).mkdir(parents=True, exist_ok=True)
+    # decode & resample the whole talk once, then slice its segments
     tfm = sox.Transformer()
-    tfm.set_output_format(rate=out_sr, channels=out_channels)
-    tfm.trim(start_sec, end_sec)
-    tfm.build_file(str(in_filepath), str(out_filepath))
+    tfm.set_output_format(rate=out_sr, channels=out_channels, bits=16)
+    with subprocess_slot():
+        audio = tfm.build_array(input_filepath=str(in_filepath)).reshape(-1)
+    for seg_id, start_sec, end_sec in segments:
+        out_filepath = out_dir / fid / f"{seg_id}.{out_format}"
+        start, end = round(start_sec * out_sr), round(end_sec * out_sr)
+        with atomic_output(out_filepath) as tmp_filepath:
+            with wave.open(str(tmp_filepath), "wb") as fout:
+                fout.setnchannels(out_channels)
+                fout.setsampwidth(2)
+                fout.setframerate(out_sr)
+                fout.writeframes(audio[start:end].tobytes())
+        ledger.mark(stage, f"{fid}/{seg_id}")
 
 
-def preprocess_mtedx_audio(mtedx_path, src_lang, muavic_path):
+def preprocess_mtedx_audio(
+    mtedx_path, src_lang, muavic_path, ledger, governor, shard=None
+):
     for split in SPLITS:
         split_dir_path = mtedx_path / f"{src_lang}-{src_lang}" / "data" / split
         audio_segments = list(read_txt_file(split_dir_path / "txt" / "segments"))
         # create directory for segmented & normalized audio
         out_path = muavic_path / src_lang / "audio" / split
         out_path.mkdir(parents=True, exist_ok=True)
-        # early-quit condition
-        num_curr_audio_segments = len(list(out_path.rglob("*.wav")))
-        if num_curr_audio_segments == len(audio_segments):
-            continue # skip if all audio segments are already processed
-        if split == "train":
-            print(f"\nSegmenting {src_lang} audio files")
-        # collect needed info from segment file
-        segments_info = []
-        wav_dir_path = split_dir_path / "wav"
+        # skip audio segments that are already processed
+        stage = f"mtedx_audio/{src_lang}/{split}"
+        processed_segments = ledger.done_items(stage)
+        # collect needed info from segment file, grouped by talk
+        talk_to_segments = defaultdict(list)
         for line in audio_segments:
             seg_id, fid, start, end = line.strip().split(" ")
-            segments_info.append(
-                (
-                    wav_dir_path / (fid + ".flac"),
-                    fid,
-                    seg_id,
-                    float(start),
-                    float(end),
-                )
-            )
+            if f"{fid}/{seg_id}" in processed_segments or not in_shard(fid, shard):
+                continue
+            talk_to_segments[fid].append((seg_id, float(start), float(end)))
+        if not talk_to_segments:
+            continue
+        # schedule the longest talks first to balance the workers' load
+        wav_dir_path = split_dir_path / "wav"
+        talks_info = sorted(
+            (
+                (wav_dir_path / (fid + ".flac"), fid, segments)
+                for fid, segments in talk_to_segments.items()
+            ),
+            key=lambda x: max(end for _, _, end in x[2]),
+            reverse=True,
+        )
+        if split == "train":
+            print(f"\nSegmenting {src_lang} audio files")
         # preprocess audio files
-        process_map(
-            partial(segment_normalize_audio_file, out_path),
-            segments_info,
-            max_workers=os.cpu_count(),
+        governor.map(
+            partial(segment_normalize_audio_file, out_path, ledger, stage),
+            talks_info,
             desc=f"Preprocessing {src_lang}/{split} Audios",
-            chunksize=1,
         )
 
 
-def segment_normalize_video(mean_face_metadata, in_path, out_path, seg_info):
-    fps = 25
-    out_format = "mp4"
-    out_filepath = out_path / f"{seg_info['id']}.{out_format}"
-    # skip if file is already segmented
-    if out_filepath.exists():
-        return
-    # start segmenting
+def get_segment_frame_range(seg_info, fps=25):
     seg_metadata_length = len(seg_info["metadata"])
     fstart = round(seg_info["start"] * fps)
     fend = (
@@ -143,39 +182,140 @@ def segment_normalize_video(mean_face_metadata, in_path, out_path, seg_info):
     )  # handles minor mismatches between metadata-length and video-length
     if fstart == fend:
         fend = fstart + 1  # adding 1-frame
-    num_frames = fend - fstart
-    vid_frames = (
-        cv2.imread(f"{in_path}/{i}.png")
-        for i in range(fstart, fend)
-        if os.path.exists(f"{in_path}/{i}.png")
+    return fstart, fend
+
+
+# per-worker state of the video preprocessing pool, see `init_video_worker()`
+VIDEO_WORKER_STATE = {}
+
+
+def init_video_worker(metadata_path, src_lang, split):
+    """Loads the mean face & the split's landmark store once per worker"""
+    VIDEO_WORKER_STATE["mean_face_metadata"] = load_meanface_metadata(metadata_path)
+    VIDEO_WORKER_STATE["landmark_store"] = load_landmark_store(
+        metadata_path / src_lang / split
     )
-    if seg_metadata_length > 0:
+
+
+def get_segment_cropper(seg_info, fps=25):
+    """
+    Returns the consumer that turns the frames of a segment into 96x96 mouth
+    patches as they're decoded (see `stream_video_segments()`).
+    """
+    if len(seg_info["metadata"]) > 0:
         # detect the mouth ROI and crop it
-        frames = crop_patch(
-            vid_frames,
-            num_frames,
+        fstart, fend = get_segment_frame_range(seg_info, fps)
+        return PatchCropper(
+            fend - fstart,
             seg_info["metadata"],
-            mean_face_metadata,
+            VIDEO_WORKER_STATE["mean_face_metadata"],
         )
-    else:
-        # resize the frames (since there were no metadata for it)
-        frames = resize_frames(vid_frames, new_size=(96, 96))
-    # save video
-    save_video(frames, out_filepath, fps)
+    # resize the frames (since there were no metadata for it)
+    return FrameResizer(new_size=(96, 96))
+
 
+def save_segment_video(
+    out_path, ledger, stage, seg_info, frames, video_store_path=None
+):
+    fps = 25
+    out_format = "mp4"
+    out_filepath = out_path / f"{seg_info['id']}.{out_format}"
+    # save video (or append it to the split's raw clip store)
+    if video_store_path is None:
+        save_video(frames, out_filepath, fps)
+    elif len(frames) > 0:
+        open_clip_store(video_store_path).write(
+            f"{out_path.name}/{seg_info['id']}", frames
+        )
+    ledger.mark(stage, f"{out_path.name}/{seg_info['id']}")
 
-def preprocess_mtedx_video(mtedx_path, metadata_path, src_lang, muavic_path):
-    mean_face_metadata = load_meanface_metadata(metadata_path)
+
+def segment_normalize_talk(
+    ledger,
+    stage,
+    out_path,
+    in_filepath,
+    video_segments,
+    video_store_path=None,
+    grayscale=False,
+):
+    """
+    Probes & decodes the talk once and crops every frame of the segments in
+    `video_segments` as it's decoded, so only the mouth patches are kept
+    (see `stream_video_segments()`).
+    """
+    out_fps = 25
+    # add metadata (rescaled to the downloaded resolution) to video_segments
+    scale = get_video_scale(in_filepath)
+    for seg in video_segments:
+        seg_metadata = VIDEO_WORKER_STATE["landmark_store"].get(
+            f"{out_path.name}/{seg['id']}"
+        )
+        if seg_metadata is None:
+            seg["metadata"] = []
+        elif scale != 1.0:
+            seg["metadata"] = seg_metadata * scale
+        else:
+            seg["metadata"] = seg_metadata
+    with subprocess_slot():
+        probe = probe_video_stream(in_filepath)
+    frame_ranges = [get_segment_frame_range(seg, out_fps) for seg in video_segments]
+    # clips are encoded while the talk is still being decoded, the decoder &
+    # the encoder each take a slot (the raw clip store doesn't encode)
+    with subprocess_slot(1 if video_store_path is not None else 2):
+        for seg_idx, frames in stream_video_segments(
+            in_filepath,
+            frame_ranges,
+            out_fps,
+            grayscale,
+            probe,
+            make_consumer=lambda idx: get_segment_cropper(
+                video_segments[idx], out_fps
+            ),
+        ):
+            save_segment_video(
+                out_path,
+                ledger,
+                stage,
+                video_segments[seg_idx],
+                frames,
+                video_store_path,
+            )
+
+
+def preprocess_mtedx_video(
+    mtedx_path,
+    metadata_path,
+    src_lang,
+    muavic_path,
+    ledger,
+    governor,
+    out_video_format="mp4",
+    grayscale=False,
+    shard=None,
+):
     for split in SPLITS:
         split_dir_path = mtedx_path / f"{src_lang}-{src_lang}" / "data" / split
-        video_segments = list(read_txt_file(split_dir_path / "txt" / "segments"))
         # create directory for segmented & normalized video
         out_path = muavic_path / src_lang / "video" / split
+        video_store_path = None
+        if out_video_format == "raw":
+            video_store_path = muavic_path / src_lang / "video_raw" / split
+            out_path = video_store_path
         out_path.mkdir(parents=True, exist_ok=True)
-        # early-quit condition (might be TOO STRICT)
-        num_curr_video_segments = len(list(out_path.rglob("*.mp4")))
-        if num_curr_video_segments == len(video_segments):
-            continue # skip if all video segments are already processed
+        # skip video segments that are already processed
+        stage = f"mtedx_video/{src_lang}/{split}"
+        if out_video_format == "raw":
+            stage += "/raw"
+        if grayscale:
+            stage += "/gray"
+        processed_segments = ledger.done_items(stage)
+        if processed_segments.issuperset(
+            fid
+            for fid in get_mtedx_fileids(split_dir_path / "txt" / "segments")
+            if in_shard(fid.split("/")[0], shard)
+        ):
+            continue
         if split == "train":
             print(
                 f"\nSegmenting `{src_lang}` videos files "
@@ -199,18 +339,22 @@ def preprocess_mtedx_video(mtedx_path, metadata_path, src_lang, muavic_path):
         video_to_segments = OrderedDict(
             sorted(video_to_segments.items(), key=lambda x: len(x[1]))
         )
+        # built here (if needed) so that the workers only have to open it
+        landmark_store = load_landmark_store(metadata_path / src_lang / split)
         print("⚠️ HACK: Limiting processing to first 2 videos only!")
         limited_items = list(video_to_segments.items())[:2]
-        out_fps = 25
+        limited_items = [item for item in limited_items if in_shard(item[0], shard)]
         video_format = "mp4"
         in_video_dir_path = mtedx_path / "video" / src_lang / split
-        for video_id, video_segments in tqdm(limited_items):
-            # check if video has been already processed:
-            all_segments_are_processed = all(
-                (out_path / video_id / f"{seg['id']}.{video_format}").exists()
+        tasks = []
+        for video_id, video_segments in limited_items:
+            # keep only the segments that haven't been processed yet
+            video_segments = [
+                seg
                 for seg in video_segments
-            )
-            if all_segments_are_processed:
+                if f"{video_id}/{seg['id']}" not in processed_segments
+            ]
+            if not video_segments:
                 continue
             # prepare to process video file
             in_filepath = in_video_dir_path / f"{video_id}.{video_format}"
@@ -220,43 +364,38 @@ def preprocess_mtedx_video(mtedx_path, metadata_path, src_lang, muavic_path):
                     " skipping!!" 
                 )
                 continue
-            tmp_dir_path = tempfile.mkdtemp()
-            (
-                ffmpeg.input(str(in_filepath))
-                .video.filter("fps", fps=out_fps)
-                .output(f"{tmp_dir_path}/%d.png", start_number=0)
-                .run(quiet=True)
-            )
-            # load metadata
-            video_metadata = load_video_metadata(
-                metadata_path / src_lang / split / f"{video_id}.pkl"
-            )
-            if video_metadata is None:
+            if video_id not in landmark_store.video_ids:
                 warnings.warn(
                     f"TED talk `{in_filepath.stem}` doesn't have metadata..." +
                     " skipping!!"
                 )
                 continue
-            # add metadata to video_segments
-            for seg in video_segments:
-                seg["metadata"] = video_metadata.get(seg["id"], [])
             # set the output path for the video segments
             out_seg_path = out_path / video_id
-            out_seg_path.mkdir(parents=True, exist_ok=True)
-            # start segmenting video into smaller segments and process them
-            process_map(
-                partial(
-                    segment_normalize_video,
-                    mean_face_metadata,
-                    tmp_dir_path,
-                    out_seg_path,
-                ),
-                video_segments,
-                max_workers=min(len(video_segments), os.cpu_count()),
-                chunksize=1,
-                disable=True,  # disables progress bar
-            )
-            shutil.rmtree(tmp_dir_path)
+            if video_store_path is None:
+                out_seg_path.mkdir(parents=True, exist_ok=True)
+            tasks.append((out_seg_path, in_filepath, video_segments))
+        # talks share one queue, longest first (by their total segment
+        # duration), so that no worker is left with a long talk at the end
+        tasks.sort(
+            key=lambda task: sum(seg["end"] - seg["start"] for seg in task[2]),
+            reverse=True,
+        )
+        if not tasks:
+            continue
+        governor.map(
+            partial(
+                segment_normalize_talk,
+                ledger,
+                stage,
+                video_store_path=video_store_path,
+                grayscale=grayscale,
+            ),
+            *zip(*tasks),
+            desc=f"Preprocessing {src_lang}/{split} Videos",
+            initializer=init_video_worker,
+            initargs=(metadata_path, src_lang, split),
+        )
 
 
 def get_mtedx_fileids(segment_filepath):
@@ -268,28 +407,51 @@ def get_mtedx_fileids(segment_filepath):
     return fids
 
 
-def prepare_mtedx_avsr_manifests(mtedx_path, lang, muavic_path):
+def prepare_mtedx_avsr_manifests(
+    mtedx_path, lang, muavic_path, governor, out_video_format="mp4", shard=None
+):
+    """
+    Writes the AVSR manifests & transcriptions. A shard only writes the
+    manifest rows of its talks, see `merge_mtedx_avsr_manifests()`.
+    """
     for split in SPLITS:
         out_manifest_filepath = muavic_path / lang / f"{split}.tsv"
+        if shard is not None:
+            out_manifest_filepath = get_shard_filepath(out_manifest_filepath, shard)
+            out_manifest_filepath.parent.mkdir(parents=True, exist_ok=True)
         if not out_manifest_filepath.exists():
             if split == "train":
                 print(f"\nCreating AVSR manifests for `{lang}`")
             mtedx_txt_dir_path = mtedx_path / f"{lang}-{lang}" / "data" / split / "txt"
             audio_datapath = muavic_path / lang / "audio" / split
             video_datapath = muavic_path / lang / "video" / split
-            fileids = get_mtedx_fileids(mtedx_txt_dir_path / "segments")
+            video_store = None
+            if out_video_format == "raw":
+                video_store = ClipStore(muavic_path / lang / "video_raw" / split)
+            fileids = [
+                fid
+                for fid in get_mtedx_fileids(mtedx_txt_dir_path / "segments")
+                if in_shard(fid.split("/")[0], shard)
+            ]
             # get audio/video frames
             av_manifest_df = pd.DataFrame(
-                process_map(
-                    partial(get_audio_video_info, audio_datapath, video_datapath),
+                governor.map(
+                    partial(
+                        get_audio_video_info,
+                        audio_datapath,
+                        video_datapath,
+                        video_store=video_store,
+                    ),
                     fileids,
                     desc=f"Creating {lang}/{split} manifest",
-                    max_workers=os.cpu_count(),
-                    chunksize=1,
-                )
+                    io_bound=True,  # only reads the files' headers
+                ),
+                columns=MANIFEST_COLUMNS,  # a shard may have no fileids
             )
             # write down the manifest TSV file
             write_av_manifest(av_manifest_df, out_manifest_filepath)
+            if shard is not None:
+                continue  # transcriptions are copied when merging
             # copy language transcription
             shutil.copyfile(
                 mtedx_txt_dir_path / f"{split}.{lang}",
@@ -297,13 +459,48 @@ def prepare_mtedx_avsr_manifests(mtedx_path, lang, muavic_path):
             )
 
 
+def merge_mtedx_avsr_manifests(mtedx_path, lang, muavic_path, num_shards):
+    """
+    Builds the AVSR manifests & transcriptions from the ones written by
+    `num_shards` shards, in the order of the segments file, as if they were
+    written by a single run. Media files aren't read again.
+    """
+    not_found_filepath = mtedx_path / "not_found_videos.txt"
+    not_found_videos = set()
+    for shard_filepath in get_shard_filepaths(not_found_filepath, num_shards):
+        not_found_videos.update(read_txt_file(shard_filepath))
+    write_txt_file(sorted(not_found_videos), not_found_filepath)
+    for split in SPLITS:
+        out_manifest_filepath = muavic_path / lang / f"{split}.tsv"
+        if out_manifest_filepath.exists():
+            continue
+        mtedx_txt_dir_path = mtedx_path / f"{lang}-{lang}" / "data" / split / "txt"
+        av_manifest_df = pd.concat(
+            [
+                read_av_manifest(shard_filepath)
+                for shard_filepath in get_shard_filepaths(
+                    out_manifest_filepath, num_shards
+                )
+            ]
+        ).set_index("id")
+        fileids = get_mtedx_fileids(mtedx_txt_dir_path / "segments")
+        write_av_manifest(
+            av_manifest_df.loc[fileids].reset_index(), out_manifest_filepath
+        )
+        # copy language transcription
+        shutil.copyfile(
+            mtedx_txt_dir_path / f"{split}.{lang}",
+            muavic_path / lang / f"{split}.{lang}",
+        )
+
+
 def prepare_mtedx_avst_manifests(mtedx_path, mt_trans_path, lang, muavic_path):
     # download & extract pseudo-translation if that wasn't done already
     lang_pair = f"{lang}-en"
     tgz_filename = f"{lang_pair}.tgz"
     tgz_filepath = mt_trans_path / tgz_filename
     url = f"https://dl.fbaipublicfiles.com/muavic/mt_trans/{tgz_filename}"
-    download_extract_file_if_not(url, tgz_filepath, lang_pair)
+    download_extract_file_if_not(url, tgz_filepath)
 
     for split in tqdm(SPLITS):
         # set output files
@@ -0,0 +1,340 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import io
+import json
+import heapq
+import queue
+import random
+import tarfile
+import argparse
+import warnings
+import threading
+import numpy as np
+from pathlib import Path
+
+from utils import read_av_manifest, read_txt_file
+from ledger_utils import atomic_output
+from clip_store_utils import ClipStore
+from resource_utils import ResourceGovernor
+
+
+SPLITS = ["train", "valid", "test"]
+
+
+def is_clip_location(video):
+    # raw clips are listed as `{part_filepath}:{byte_offset}:{num_frames}`
+    return video.count(":") >= 2 and video.rsplit(":", 2)[-1].isdigit()
+
+
+def balance_samples(lengths, num_shards, seed=0):
+    """
+    Splits sample indices into `num_shards` shards of (almost) equal size
+    and total length: the longest samples are placed first, each one in the
+    non-full shard with the smallest total length so far. Every shard gets a
+    mix of long & short samples, which are then shuffled within the shard.
+    """
+    capacity = -(-len(lengths) // num_shards)
+    heap = [(0, shard_idx) for shard_idx in range(num_shards)]
+    shards = [[] for _ in range(num_shards)]
+    for idx in np.argsort(-np.asarray(lengths), kind="stable").tolist():
+        total_length, shard_idx = heapq.heappop(heap)
+        shards[shard_idx].append(idx)
+        if len(shards[shard_idx]) < capacity:
+            heapq.heappush(heap, (total_length + lengths[idx], shard_idx))
+    rng = random.Random(seed)
+    for shard in shards:
+        rng.shuffle(shard)
+    rng.shuffle(shards)
+    return shards
+
+
+def add_tar_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def iter_tar_members(fin):
+    """
+    Yields (name, data) of the members of a USTAR tar file as written by
+    `write_shard()`, reading the file strictly sequentially. Much faster than
+    `tarfile`'s stream mode, which parses every header into a `TarInfo`.
+    """
+    while len(header := fin.read(tarfile.BLOCKSIZE)) == tarfile.BLOCKSIZE:
+        if header == tarfile.NUL * tarfile.BLOCKSIZE:
+            return  # end-of-archive marker
+        name = header[:100].rstrip(tarfile.NUL).decode()
+        size = int(header[124:136].rstrip(b"\0 ") or b"0", 8)
+        yield name, fin.read(size)
+        fin.read(-size % tarfile.BLOCKSIZE)  # padding
+
+
+def write_shard(rows, shard_filepath):
+    """
+    Writes a tar shard where every sample is stored as consecutive members
+    `{key}.json` (id & lengths), `{key}.wav`, `{key}.mp4` (or `{key}.npy` for
+    raw clips) and `{key}.txt` (label), so it can be read sequentially.
+    """
+    with atomic_output(shard_filepath) as tmp_filepath:
+        with tarfile.open(tmp_filepath, "w", format=tarfile.USTAR_FORMAT) as tar:
+            for row in rows:
+                key = row["key"]
+                meta = {
+                    "id": row["id"],
+                    "video_frames": int(row["video_frames"]),
+                    "audio_samples": int(row["audio_samples"]),
+                }
+                add_tar_member(tar, f"{key}.json", json.dumps(meta).encode())
+                with open(row["audio"], "rb") as fin:
+                    add_tar_member(tar, f"{key}.wav", fin.read())
+                if is_clip_location(row["video"]):
+                    buffer = io.BytesIO()
+                    np.save(buffer, ClipStore.load_clip(row["video"]))
+                    add_tar_member(tar, f"{key}.npy", buffer.getvalue())
+                else:
+                    with open(row["video"], "rb") as fin:
+                        add_tar_member(tar, f"{key}.mp4", fin.read())
+                add_tar_member(tar, f"{key}.txt", row["label"].encode())
+    return len(rows)
+
+
+def pack_split(
+    manifest_filepath,
+    label_filepath,
+    out_path,
+    governor,
+    samples_per_shard=1000,
+    seed=0,
+):
+    """
+    Packs the samples of an AVSR/AVST manifest & its label file into
+    shuffled, length-balanced tar shards `{split}-{idx:05d}.tar` and writes
+    `{split}.json` listing them. Samples with missing audio/video are skipped.
+    """
+    split = manifest_filepath.stem
+    index_filepath = out_path / f"{split}.json"
+    if index_filepath.exists():
+        return
+    df = read_av_manifest(manifest_filepath)
+    labels = list(read_txt_file(label_filepath))
+    assert len(labels) == len(df), f"{label_filepath} doesn't match the manifest!!"
+    df["label"] = labels
+    # keys keep the manifest order, tar member names can't contain the ids
+    df["key"] = [f"{idx:09d}" for idx in range(len(df))]
+    is_missing = (df["video_frames"] < 0) | (df["audio_samples"] < 0)
+    if is_missing.any():
+        warnings.warn(
+            f"{is_missing.sum()} samples of `{manifest_filepath}` have missing "
+            + "audio/video... skipping!!"
+        )
+        df = df[~is_missing].reset_index(drop=True)
+    out_path.mkdir(parents=True, exist_ok=True)
+    num_shards = max(1, -(-len(df) // samples_per_shard))
+    rows = df.to_dict("records")
+    shards = [
+        [rows[idx] for idx in shard]
+        for shard in balance_samples(df["video_frames"].tolist(), num_shards, seed)
+    ]
+    shard_filenames = [f"{split}-{idx:05d}.tar" for idx in range(num_shards)]
+    # shards are written concurrently, reading & writing is I/O-bound
+    num_samples = governor.map(
+        write_shard,
+        shards,
+        [out_path / filename for filename in shard_filenames],
+        desc=f"Packing {manifest_filepath.parent.name}/{split}",
+        io_bound=True,
+    )
+    with atomic_output(index_filepath) as tmp_filepath:
+        with open(tmp_filepath, "w") as fout:
+            json.dump(
+                {
+                    "shards": shard_filenames,
+                    "num_samples": num_samples,
+                    "video_frames": [
+                        sum(row["video_frames"] for row in shard)
+                        for shard in shards
+                    ],
+                },
+                fout,
+                indent=2,
+            )
+
+
+class ShardReader:
+    """
+    Streams the samples of packed shards (see `pack_split()`) with sequential
+    reads only. A background thread reads the shards one after the other
+    (in a new random order every epoch when `shuffle`) and keeps up to
+    `prefetch` chunks of `chunk_size` samples ready, so storage latency
+    overlaps with training; chunks keep the hand-over cost per sample low.
+    Samples are dicts with `id`, `video_frames`, `audio_samples`, `label`
+    and the raw bytes of `audio` (wav) and `video` (mp4, or npy raw clip).
+    """
+
+    def __init__(
+        self,
+        index_filepath,
+        shuffle=True,
+        seed=0,
+        prefetch=8,
+        chunk_size=32,
+        read_buffer_size=1 << 16,
+    ):
+        self.index_filepath = Path(index_filepath)
+        with open(self.index_filepath) as fin:
+            index = json.load(fin)
+        self.shard_filepaths = [
+            self.index_filepath.parent / filename for filename in index["shards"]
+        ]
+        self.num_samples = sum(index["num_samples"])
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        self.chunk_size = chunk_size
+        self.read_buffer_size = read_buffer_size
+        self.epoch = 0
+
+    def __len__(self):
+        return self.num_samples
+
+    def iter_shard(self, shard_filepath):
+        with open(shard_filepath, "rb", buffering=self.read_buffer_size) as fin:
+            sample, key = {}, None
+            for name, data in iter_tar_members(fin):
+                member_key, _, ext = name.partition(".")
+                if member_key != key and sample:
+                    yield sample
+                    sample = {}
+                key = member_key
+                if ext == "json":
+                    sample.update(json.loads(data))
+                elif ext == "txt":
+                    sample["label"] = data.decode()
+                elif ext == "wav":
+                    sample["audio"] = data
+                else:
+                    sample["video"], sample["video_format"] = data, ext
+            if sample:
+                yield sample
+
+    @staticmethod
+    def put(chunks, item, stop):
+        # gives up when the consumer stopped iterating
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read_shards(self, shard_filepaths, chunks, stop):
+        try:
+            chunk = []
+            for shard_filepath in shard_filepaths:
+                for sample in self.iter_shard(shard_filepath):
+                    chunk.append(sample)
+                    if len(chunk) == self.chunk_size:
+                        if not self.put(chunks, chunk, stop):
+                            return
+                        chunk = []
+            if chunk and not self.put(chunks, chunk, stop):
+                return
+        except Exception as e:
+            self.put(chunks, e, stop)
+        self.put(chunks, None, stop)
+
+    def __iter__(self):
+        shard_filepaths = list(self.shard_filepaths)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shard_filepaths)
+        self.epoch += 1
+        chunks, stop = queue.Queue(maxsize=self.prefetch), threading.Event()
+        reader = threading.Thread(
+            target=self.read_shards,
+            args=(shard_filepaths, chunks, stop),
+            daemon=True,
+        )
+        reader.start()
+        try:
+            while (chunk := chunks.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield from chunk
+        finally:
+            stop.set()
+            reader.join()
+
+
+def pack_dataset(
+    data_path,
+    label_ext,
+    out_path,
+    governor,
+    samples_per_shard=1000,
+    manifest_suffix="",
+):
+    """
+    Packs `{split}{manifest_suffix}.tsv` & `{split}{manifest_suffix}.{label_ext}`
+    of every split in `data_path`, e.g. `train_avst.tsv` & `train_avst.en`
+    with `manifest_suffix="_avst"`.
+    """
+    for split in SPLITS:
+        name = f"{split}{manifest_suffix}"
+        manifest_filepath = data_path / f"{name}.tsv"
+        if not manifest_filepath.exists():
+            warnings.warn(f"`{manifest_filepath}` doesn't exist... skipping!!")
+            continue
+        pack_split(
+            manifest_filepath,
+            data_path / f"{name}.{label_ext}",
+            out_path,
+            governor,
+            samples_per_shard,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Packs MuAViC manifests into tar shards for training."
+    )
+    parser.add_argument(
+        "--data-path",
+        required=True,
+        type=Path,
+        help="Directory of the `{split}.tsv` manifests, e.g. `${ROOT}/muavic/es`.",
+    )
+    parser.add_argument(
+        "--label-ext",
+        required=True,
+        help="Extension of the label files, e.g. `es` for `{split}.es`.",
+    )
+    parser.add_argument(
+        "--out-path",
+        type=Path,
+        help="Where to write the shards (default: `${DATA_PATH}/packed`).",
+    )
+    parser.add_argument(
+        "--manifest-suffix",
+        default="",
+        help="Suffix of the manifest names, e.g. `_avst` for `{split}_avst.tsv`.",
+    )
+    parser.add_argument("--samples-per-shard", type=int, default=1000)
+    parser.add_argument(
+        "--io-workers",
+        default=8,
+        type=int,
+        help="Number of shards to write concurrently.",
+    )
+    args = parser.parse_args()
+    pack_dataset(
+        args.data_path,
+        args.label_ext,
+        args.out_path or args.data_path / "packed",
+        ResourceGovernor(io_workers=args.io_workers),
+        args.samples_per_shard,
+        args.manifest_suffix,
+    )
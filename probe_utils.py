@@ -0,0 +1,108 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import struct
+
+
+# MP4 boxes that only contain other boxes (on the way to `stts`)
+MP4_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def probe_wav(wav_filepath):
+    """Returns (num_samples, sample_rate) read from the RIFF header"""
+    with open(wav_filepath, "rb") as fin:
+        riff, _, wave = struct.unpack("<4sI4s", fin.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{wav_filepath} is not a RIFF/WAVE file!")
+        block_align = sample_rate = None
+        while True:
+            header = fin.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{wav_filepath} has no `data` chunk!")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                _, _, sample_rate, _, block_align = struct.unpack(
+                    "<HHIIH", fin.read(14)
+                )
+                fin.seek(chunk_size - 14 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if not block_align:
+                    raise ValueError(f"{wav_filepath} has no `fmt ` chunk!")
+                data_size = os.fstat(fin.fileno()).st_size - fin.tell()
+                if chunk_size not in {0, 0xFFFFFFFF}:
+                    # size is unset when the file was written to a pipe
+                    data_size = min(chunk_size, data_size)
+                return data_size // block_align, sample_rate
+            else:
+                fin.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def iter_mp4_boxes(fin, end):
+    """Yields (box_type, payload_start, payload_end) for boxes until `end`"""
+    while fin.tell() + 8 <= end:
+        box_start = fin.tell()
+        size, box_type = struct.unpack(">I4s", fin.read(8))
+        if size == 1:  # 64-bit box size
+            (size,) = struct.unpack(">Q", fin.read(8))
+        elif size == 0:  # box extends to the end of its parent
+            size = end - box_start
+        if size < 8 or box_start + size > end:
+            raise ValueError(f"Invalid MP4 box `{box_type}`!")
+        yield box_type, fin.tell(), box_start + size
+        fin.seek(box_start + size)
+
+
+def read_mp4_video_track(fin, end):
+    """Returns (num_frames, duration) of the first video track found"""
+    for box_type, start, box_end in iter_mp4_boxes(fin, end):
+        if box_type == b"trak":
+            track = {}
+            read_mp4_track_boxes(fin, box_end, track)
+            if track.get("handler") == b"vide" and track.keys() >= {
+                "num_frames", "timescale"
+            }:
+                return track["num_frames"], track["duration"] / track["timescale"]
+        elif box_type == b"moov":
+            return read_mp4_video_track(fin, box_end)
+    return None
+
+
+def read_mp4_track_boxes(fin, end, track):
+    for box_type, start, box_end in iter_mp4_boxes(fin, end):
+        if box_type in MP4_CONTAINER_BOXES:
+            read_mp4_track_boxes(fin, box_end, track)
+        elif box_type == b"hdlr":
+            fin.seek(start + 8)  # version, flags & pre_defined
+            track["handler"] = fin.read(4)
+        elif box_type == b"mdhd":
+            version = fin.read(1)[0]
+            fin.seek(3, os.SEEK_CUR)  # flags
+            if version == 1:
+                _, _, timescale, duration = struct.unpack(">QQIQ", fin.read(28))
+            else:
+                _, _, timescale, duration = struct.unpack(">IIII", fin.read(16))
+            track["timescale"], track["duration"] = timescale, duration
+        elif box_type == b"stts":
+            fin.seek(4, os.SEEK_CUR)  # version & flags
+            (num_entries,) = struct.unpack(">I", fin.read(4))
+            entries = struct.unpack(f">{2 * num_entries}I", fin.read(8 * num_entries))
+            if num_entries == 0:
+                continue  # fragmented MP4, samples are described in `moof`
+            track["num_frames"] = sum(entries[0::2])
+            if not track.get("duration"):
+                track["duration"] = sum(
+                    count * delta for count, delta in zip(entries[0::2], entries[1::2])
+                )
+
+
+def probe_mp4(mp4_filepath):
+    """Returns (num_frames, duration) of the video stream from the `moov` box"""
+    with open(mp4_filepath, "rb") as fin:
+        file_size = os.fstat(fin.fileno()).st_size
+        video_track = read_mp4_video_track(fin, file_size)
+    if video_track is None:
+        raise ValueError(f"{mp4_filepath} doesn't have a parsable video track!")
+    return video_track
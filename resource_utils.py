@@ -0,0 +1,185 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+import time
+import threading
+import multiprocessing
+from tqdm import tqdm
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# subprocess limits of the current process, set by `install_limits()`
+SUBPROCESS_LIMITS = {"semaphore": None, "lock": None, "max_slots": 1, "threads": 0}
+_slot_state = threading.local()
+
+
+def install_limits(
+    semaphore,
+    lock,
+    max_slots,
+    subprocess_threads,
+    initializer=None,
+    initargs=(),
+):
+    """Pool initializer: applies the governor's limits to a worker process"""
+    SUBPROCESS_LIMITS["semaphore"] = semaphore
+    SUBPROCESS_LIMITS["lock"] = lock
+    SUBPROCESS_LIMITS["max_slots"] = max_slots
+    SUBPROCESS_LIMITS["threads"] = subprocess_threads
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def get_subprocess_threads():
+    """Threads each ffmpeg/sox decoder or encoder may use (0 lets it decide)"""
+    return SUBPROCESS_LIMITS["threads"]
+
+
+def get_max_slots():
+    """Max number of slots a block can hold, see `subprocess_slot()`"""
+    return SUBPROCESS_LIMITS["max_slots"]
+
+
+@contextmanager
+def subprocess_slot(num_slots=1):
+    """
+    Holds `num_slots` of the governor's slots while the block runs, one per
+    ffmpeg/sox decoder or encoder that runs at once in it (e.g. 2 to encode
+    clips while their video is still being decoded). Slots are taken all at
+    once, by one process at a time, and nested blocks share the slots of the
+    outermost one instead of taking more, so waiting for slots can't deadlock.
+    """
+    semaphore = SUBPROCESS_LIMITS["semaphore"]
+    if getattr(_slot_state, "depth", 0) == 0 and semaphore is not None:
+        num_slots = min(num_slots, get_max_slots())
+        with SUBPROCESS_LIMITS["lock"]:
+            for _ in range(num_slots):
+                semaphore.acquire()
+        _slot_state.semaphore, _slot_state.num_slots = semaphore, num_slots
+    _slot_state.depth = getattr(_slot_state, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _slot_state.depth -= 1
+        if _slot_state.depth == 0 and getattr(_slot_state, "semaphore", None):
+            for _ in range(_slot_state.num_slots):
+                _slot_state.semaphore.release()
+            _slot_state.semaphore = None
+
+
+def timed_call(fn, *args):
+    start_time = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - start_time
+
+
+class ResourceGovernor:
+    """
+    Central budget that all stages draw their workers from: `num_workers`
+    processes for CPU-bound work, `io_workers` threads for I/O-bound work, and
+    at most `max_subprocesses` ffmpeg/sox decoders & encoders running at once
+    (across all workers, see `subprocess_slot()`) using
+    `num_workers // max_subprocesses` threads each, so the children don't
+    oversubscribe the machine. The busy time of every stage is
+    recorded to report how well it used its workers.
+    """
+
+    def __init__(self, num_workers=None, io_workers=8, max_subprocesses=None):
+        self.num_workers = num_workers or os.cpu_count()
+        self.io_workers = io_workers
+        self.max_subprocesses = max_subprocesses or self.num_workers
+        self.subprocess_threads = max(1, self.num_workers // self.max_subprocesses)
+        self.semaphore = multiprocessing.BoundedSemaphore(self.max_subprocesses)
+        # serializes taking several slots at once
+        self.slot_lock = multiprocessing.Lock()
+        self.stats = {}  # stage -> (num_tasks, num_workers, wall_sec, busy_sec)
+        # the main process follows the same limits as the workers
+        install_limits(*self.get_limits())
+
+    def get_limits(self):
+        return (
+            self.semaphore,
+            self.slot_lock,
+            self.max_subprocesses,
+            self.subprocess_threads,
+        )
+
+    def map(
+        self,
+        fn,
+        *iterables,
+        desc=None,
+        io_bound=False,
+        max_workers=None,
+        initializer=None,
+        initargs=(),
+    ):
+        """
+        Like `tqdm.contrib.concurrent.process_map` (results keep the order of
+        `iterables`, tasks are handed out one at a time) with workers taken
+        from the CPU budget, or threads from the I/O budget when `io_bound`.
+        `initializer(*initargs)` runs once per worker.
+        """
+        budget = self.io_workers if io_bound else self.num_workers
+        max_workers = min(max_workers or budget, budget)
+        if io_bound:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            if initializer is not None:
+                initializer(*initargs)
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=install_limits,
+                initargs=(*self.get_limits(), initializer, initargs),
+            )
+        iterables = [list(iterable) for iterable in iterables]
+        num_tasks = min(map(len, iterables), default=0)
+        results, busy_sec = [], 0.0
+        start_time = time.monotonic()
+        with executor:
+            for result, task_sec in tqdm(
+                executor.map(partial(timed_call, fn), *iterables, chunksize=1),
+                total=num_tasks,
+                desc=desc,
+            ):
+                results.append(result)
+                busy_sec += task_sec
+        wall_sec = time.monotonic() - start_time
+        self.record(desc, num_tasks, max_workers, wall_sec, busy_sec)
+        return results
+
+    def record(self, stage, num_tasks, num_workers, wall_sec, busy_sec):
+        prev_tasks, _, prev_wall, prev_busy = self.stats.get(stage, (0, 0, 0, 0))
+        self.stats[stage] = (
+            prev_tasks + num_tasks,
+            num_workers,
+            prev_wall + wall_sec,
+            prev_busy + busy_sec,
+        )
+        print(f"{stage}: {self.format_stats(*self.stats[stage])}")
+
+    @staticmethod
+    def format_stats(num_tasks, num_workers, wall_sec, busy_sec):
+        utilization = busy_sec / (wall_sec * num_workers) if wall_sec else 0.0
+        return (
+            f"{num_tasks} tasks, {num_workers} workers, "
+            + f"{wall_sec:.1f}s, {utilization:.0%} utilization"
+        )
+
+    def report(self):
+        """Prints the utilization of every stage that used the governor"""
+        if not self.stats:
+            return
+        print(
+            f"\nResource usage ({self.num_workers} CPU workers, "
+            + f"{self.io_workers} I/O workers, "
+            + f"{self.max_subprocesses} subprocesses x "
+            + f"{self.subprocess_threads} threads):"
+        )
+        for stage, stats in self.stats.items():
+            print(f"  {stage}: {self.format_stats(*stats)}")
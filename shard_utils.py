@@ -0,0 +1,55 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import hashlib
+import argparse
+
+
+def parse_shard(shard):
+    """Parses a `K/N` shard spec (the K-th of N shards, 0-based) into (K, N)"""
+    try:
+        shard_idx, num_shards = map(int, shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"`{shard}` isn't of the form K/N")
+    if not 0 <= shard_idx < num_shards:
+        raise argparse.ArgumentTypeError(f"`{shard}` needs 0 <= K < N")
+    return shard_idx, num_shards
+
+
+def get_shard_idx(key, num_shards):
+    # md5 rather than `hash()` which is salted differently in every process
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % num_shards
+
+
+def in_shard(key, shard):
+    """Whether `key` (a talk/source video id) belongs to `shard`"""
+    if shard is None:
+        return True
+    shard_idx, num_shards = shard
+    return get_shard_idx(key, num_shards) == shard_idx
+
+
+def get_shard_filepath(filepath, shard):
+    """`{dir}/train.tsv` -> `{dir}/shards/train.{K}-of-{N}.tsv`"""
+    shard_idx, num_shards = shard
+    return (
+        filepath.parent
+        / "shards"
+        / f"{filepath.stem}.{shard_idx}-of-{num_shards}{filepath.suffix}"
+    )
+
+
+def get_shard_filepaths(filepath, num_shards):
+    """Returns the files written by all shards for `filepath`"""
+    shard_filepaths = [
+        get_shard_filepath(filepath, (shard_idx, num_shards))
+        for shard_idx in range(num_shards)
+    ]
+    missing = [str(p) for p in shard_filepaths if not p.exists()]
+    if missing:
+        raise FileNotFoundError(
+            "Some shards haven't finished yet, missing: " + ", ".join(missing)
+        )
+    return shard_filepaths
@@ -0,0 +1,71 @@
+# Copyright (c) Meta Platforms, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+import re
+from itertools import chain
+
+
+PUNCS = "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~؟؛,’‘×÷"
+PUNCS_TABLE = str.maketrans("", "", PUNCS)
+PUNCS_REGEX = re.compile(f"[{re.escape(PUNCS)}]+")
+# sound-effect descriptions, e.g. `(Laughter)`
+SOUND_EFFECT_REGEX = re.compile(r"\([^)]*\)")
+# same, without crossing the line breaks between the texts of a batch
+BATCH_SOUND_EFFECT_REGEX = re.compile(r"\([^)\n]*\)")
+# end-of-sentence whitespace, src: https://ideone.com/25TUP2
+# NOTE: the punctuation is checked first, the abbreviations only after a match
+# (instead of checking them before every character), the splits are the same
+SENT_END_REGEX = re.compile(
+    r"(?<=[.!,?؟،])(?<!Mr.)(?<!Mrs.)(?<!Ms.)(?<!Dr.)(?<!Jr.)\s{1,2}"
+)
+NORMALIZE_CHUNK_SIZE = 100_000
+
+
+def normalize_text(text):
+    # remove sound-effect description
+    text = SOUND_EFFECT_REGEX.sub("", text)
+    # remove punctuations & normalize case
+    return text.translate(PUNCS_TABLE).lower().strip()
+
+
+def normalize_chunk(texts):
+    """
+    Same as `normalize_text()` on every text, but the texts are joined and
+    normalized at once, which saves the per-call overhead.
+    """
+    joined = "\n".join(texts)
+    if joined.count("\n") != len(texts) - 1:
+        # texts with line breaks can't be told apart after joining
+        return [normalize_text(text) for text in texts]
+    joined = BATCH_SOUND_EFFECT_REGEX.sub("", joined)
+    # `str.translate()` is only fast on ASCII strings, a regex is otherwise
+    if joined.isascii():
+        joined = joined.translate(PUNCS_TABLE)
+    else:
+        joined = PUNCS_REGEX.sub("", joined)
+    joined = joined.lower()
+    return [text.strip() for text in joined.split("\n")]
+
+
+def normalize_texts(texts, governor=None, chunk_size=NORMALIZE_CHUNK_SIZE):
+    """
+    Normalizes a list (or any iterable, e.g. a DataFrame column) of texts in
+    chunks of `chunk_size`, which run in parallel on the governor's workers
+    when a `governor` is given.
+    """
+    texts = list(texts)
+    chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if governor is None or len(chunks) < 2:
+        return list(chain.from_iterable(map(normalize_chunk, chunks)))
+    return list(
+        chain.from_iterable(
+            governor.map(normalize_chunk, chunks, desc="Normalizing text")
+        )
+    )
+
+
+def split_sents(text):
+    """Splits `text` at the whitespace after end-of-sentence punctuation"""
+    return SENT_END_REGEX.split(text)
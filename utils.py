@@ -4,21 +4,32 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 import re
+import math
 import cv2
+import json
 import sox
 import wget
-import yt_dlp
 import ffmpeg
 import pickle
+import shutil
+import struct
 import tarfile
 import warnings
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from skimage import transform
+from itertools import islice
+from fractions import Fraction
 from collections import deque
 from urllib.error import HTTPError
 
+from probe_utils import probe_wav, probe_mp4
+from ledger_utils import Ledger, atomic_output, exclusive_lock
+from manifest_utils import read_manifest, write_manifest
+from resource_utils import subprocess_slot, get_subprocess_threads
+from text_utils import normalize_text, normalize_texts, split_sents
+
 
 def is_empty(path):
     return any(path.iterdir()) == False
@@ -34,20 +45,14 @@ def write_txt_file(lines, out_txt_filepath):
         fout.writelines("\n".join([ln.strip() for ln in lines]))
 
 
-def normalize_text(text):
-    PUNCS = "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~؟؛,’‘×÷"
-    # remove sound-effect description
-    text = re.sub(r"\([^)]*\)", "", text)
-    # remove punctuations
-    text = text.translate(str.maketrans("", "", PUNCS))
-    # normalize case
-    text = text.lower()
-    return text.strip()
-
-
 def download_file(url, download_path):
     filename = url.rpartition("/")[-1]
-    if not (download_path / filename).exists():
+    if (download_path / filename).exists():
+        return True
+    # shards sharing `download_path` download the file only once
+    with exclusive_lock(download_path / f".{filename}.download.lock"):
+        if (download_path / filename).exists():
+            return True  # downloaded by another process while waiting
         try:
             # download file
             print(f"Downloading {filename} from {url}")
@@ -59,36 +64,59 @@ def download_file(url, download_path):
                 )
                 + " MB"
             )
-            wget.download(url, out=str(download_path / filename), bar=custom_bar)
+            with atomic_output(download_path / filename) as tmp_filepath:
+                wget.download(url, out=str(tmp_filepath), bar=custom_bar)
         except Exception as e:
             message = f"Downloading {filename} failed!"
             raise HTTPError(e.url, e.code, message, e.hdrs, e.fp)
     return True
 
 
-def extract_tgz(tgz_filepath, extract_path, out_filename=None):
+def extract_tgz(tgz_filepath, extract_path, include=None):
+    """
+    Extracts the files of `tgz_filepath` accepted by `include(member_name)`
+    (all of them by default) in a single streaming pass over the archive.
+    Files that already exist with the right size are skipped.
+    """
     if not tgz_filepath.exists():
         raise FileNotFoundError(f"{tgz_filepath} is not found!!")
     tgz_filename = tgz_filepath.name
-    tgz_object = tarfile.open(tgz_filepath)
-    if not out_filename:
-        out_filename = tgz_object.getnames()[0]
     # check if file is already extracted
-    if not (extract_path / out_filename).exists():
-        for mem in tqdm(tgz_object.getmembers(), desc=f"Extracting {tgz_filename}"):
-            out_filepath = extract_path / mem.get_info()["name"]
-            if mem.isfile() and not out_filepath.exists():
-                tgz_object.extract(mem, path=extract_path)
-    tgz_object.close()
-
-
-def download_extract_file_if_not(url, tgz_filepath, download_filename):
+    done_filepath = extract_path / f".{tgz_filename}.done"
+    if done_filepath.exists():
+        return
+    with open(tgz_filepath, "rb") as fin, tqdm(
+        total=tgz_filepath.stat().st_size,
+        unit="B",
+        unit_scale=True,
+        desc=f"Extracting {tgz_filename}",
+    ) as pbar, tarfile.open(fileobj=fin, mode="r|gz") as tgz_object:
+        for mem in tgz_object:
+            pbar.update(fin.tell() - pbar.n)
+            if not mem.isfile() or (include and not include(mem.name)):
+                continue
+            out_filepath = extract_path / mem.name
+            if out_filepath.exists() and out_filepath.stat().st_size == mem.size:
+                continue
+            out_filepath.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_output(out_filepath) as tmp_filepath:
+                with open(tmp_filepath, "wb") as fout:
+                    shutil.copyfileobj(tgz_object.extractfile(mem), fout)
+        pbar.update(fin.tell() - pbar.n)
+    done_filepath.touch()
+
+
+def download_extract_file_if_not(url, tgz_filepath, include=None):
     download_path = tgz_filepath.parent
-    if not tgz_filepath.exists():
-        # download file
-        download_file(url, download_path)
-    # extract file
-    extract_tgz(tgz_filepath, download_path, download_filename)
+    if (download_path / f".{tgz_filepath.name}.done").exists():
+        return  # already extracted
+    # a single process (of all shards) downloads & extracts, others wait
+    with exclusive_lock(download_path / f".{tgz_filepath.name}.extract.lock"):
+        if not tgz_filepath.exists():
+            # download file
+            download_file(url, download_path)
+        # extract file
+        extract_tgz(tgz_filepath, download_path, include)
 
 
 def load_meanface_metadata(metadata_path):
@@ -101,17 +129,20 @@ def load_meanface_metadata(metadata_path):
     return np.load(mean_face_filepath)
 
 
+def download_video_metadata(lang_dir):
+    lang = lang_dir.name
+    tgz_filepath = lang_dir.parent / f"{lang}_metadata.tgz"
+    download_extract_file_if_not(
+        url=f"https://dl.fbaipublicfiles.com/muavic/metadata/{lang}_metadata.tgz",
+        tgz_filepath=tgz_filepath,
+        include=lambda name: name.endswith(".pkl"),
+    )
+
+
 def load_video_metadata(filepath):
     if not filepath.exists():
         # download & extract file
-        lang_dir = filepath.parent.parent
-        lang = lang_dir.name
-        tgz_filepath = lang_dir.parent / f"{lang}_metadata.tgz"
-        download_extract_file_if_not(
-            url=f"https://dl.fbaipublicfiles.com/muavic/metadata/{lang}_metadata.tgz",
-            tgz_filepath=tgz_filepath,
-            download_filename=lang
-        )
+        download_video_metadata(filepath.parent.parent)
     if not filepath.exists():
         # file doesn't have metadata
         return None
@@ -121,26 +152,57 @@ def load_video_metadata(filepath):
     return metadata
 
 
-def download_video_from_youtube(download_path, yt_id):
-    """Downloads a video from YouTube given its id on YouTube"""
-    video_out_path = download_path / f"{yt_id}.mp4"
-    if video_out_path.exists():
-        downloaded = True
-    else:
-        url = f"https://www.youtube.com/watch?v={yt_id}"
-        # UPDATED: Force high quality (Best Video + Best Audio merged to MP4)
-        ydl_opts = {
-            "quiet": True, 
-            "format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
-            "outtmpl": str(video_out_path)
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                ydl.download([url])
-                downloaded = True
-            except yt_dlp.utils.DownloadError:
-                downloaded = False
-    return downloaded
+def get_face_size(landmarks, percentile=10):
+    """
+    Returns the face width in pixels that `percentile`% of the frames are
+    smaller than. `landmarks` is a list of (68, 2) arrays or None.
+    """
+    landmarks = [lnd for lnd in landmarks if lnd is not None]
+    if not landmarks:
+        return None
+    landmarks = np.asarray(landmarks)
+    widths = landmarks[..., 0].max(axis=-1) - landmarks[..., 0].min(axis=-1)
+    return float(np.percentile(widths, percentile))
+
+
+def get_video_face_size(video_metadata, percentile=10):
+    if video_metadata is None:
+        return None
+    return get_face_size(
+        [lnd for seg_metadata in video_metadata.values() for lnd in seg_metadata],
+        percentile,
+    )
+
+
+def get_video_landmark_extent(video_metadata):
+    """
+    Returns the (max x, max y) of the landmarks of a video in pixels, which
+    the resolution they were detected at must contain. None without landmarks.
+    """
+    if video_metadata is None:
+        return None
+    landmarks = [
+        lnd
+        for seg_metadata in video_metadata.values()
+        for lnd in seg_metadata
+        if lnd is not None
+    ]
+    if not landmarks:
+        return None
+    return tuple(np.concatenate(landmarks).reshape(-1, 2).max(axis=0).tolist())
+
+
+def get_video_scale(video_filepath):
+    """
+    Returns the ratio between the resolution `video_filepath` was downloaded
+    at and the one its landmark metadata belongs to.
+    """
+    resolution_filepath = video_filepath.with_suffix(".json")
+    if not resolution_filepath.exists():
+        return 1.0
+    with open(resolution_filepath) as fin:
+        resolution = json.load(fin)
+    return resolution["height"] / resolution["ref_height"]
 
 
 # def save_video(frames, out_filepath, fps):
@@ -181,75 +243,311 @@ def get_video_duration(video_filepath):
         return -1
 
 
-def get_video_resolution(video_filepath):
-    for stream in ffmpeg.probe(video_filepath)["streams"]:
+def probe_video_stream(video_filepath):
+    """Returns the ffprobe info of the video stream & of the container"""
+    probe = ffmpeg.probe(video_filepath)
+    for stream in probe["streams"]:
         if stream["codec_type"] == "video":
-            height = int(stream["height"])
-            width = int(stream["width"])
-            return height, width
+            return stream, probe["format"]
     raise TypeError(f"Input file: {video_filepath} doesn't have video stream!")
 
 
-def get_audio_video_info(audio_path, video_path, fid):
+def get_probed_duration(probe):
+    """Duration in seconds of the video stream of a `probe_video_stream()` result"""
+    stream, container = probe
+    return float(stream.get("duration", container.get("duration", -1)))
+
+
+def get_video_resolution(video_filepath):
+    stream, _ = probe_video_stream(video_filepath)
+    height = int(stream["height"])
+    width = int(stream["width"])
+    return height, width
+
+
+def get_audio_samples(audio_filepath, sample_rate=16_000):
+    try:
+        num_samples, file_sample_rate = probe_wav(audio_filepath)
+        if file_sample_rate == sample_rate:
+            return num_samples
+        return int(num_samples * sample_rate / file_sample_rate)
+    except (ValueError, struct.error):
+        # header couldn't be parsed, ask `soxi`
+        return int(get_audio_duration(audio_filepath) * sample_rate)
+
+
+def get_video_frames(video_filepath, fps=25):
+    try:
+        num_frames, duration = probe_mp4(video_filepath)
+        if round(num_frames / duration) == fps:
+            return num_frames
+        return int(duration * fps)
+    except (ValueError, struct.error, ZeroDivisionError):
+        # header couldn't be parsed, ask `ffprobe`
+        return int(get_video_duration(video_filepath) * fps)
+
+
+def get_header_video_duration(video_filepath):
+    """Returns the duration read from the mp4 header, None if it can't be parsed"""
+    try:
+        return probe_mp4(video_filepath)[1]
+    except (OSError, ValueError, struct.error, ZeroDivisionError):
+        return None
+
+
+def get_audio_video_info(audio_path, video_path, fid, video_store=None):
+    """
+    Returns the manifest row of `fid`. With a `video_store`, the video is
+    given as a `{part_filepath}:{byte_offset}:{num_frames}` clip location.
+    """
     audio_filepath = audio_path / f"{fid}.wav"
     video_filepath = video_path / f"{fid}.mp4"
     audio_frames = (
-        int(get_audio_duration(audio_filepath) * 16_000)
-        if audio_filepath.exists()
-        else -1
-    )
-    video_frames = (
-        int(get_video_duration(video_filepath) * 25) if video_filepath.exists() else -1
+        get_audio_samples(audio_filepath) if audio_filepath.exists() else -1
     )
+    if video_store is None:
+        video = str(video_filepath)
+        video_frames = (
+            get_video_frames(video_filepath) if video_filepath.exists() else -1
+        )
+    elif fid in video_store:
+        video, video_frames = video_store.get_location(fid)
+    else:
+        video, video_frames = str(video_store.store_path / fid), -1
     return {
         "id": fid,
-        "video": str(video_filepath),
+        "video": video,
         "audio": str(audio_filepath),
         "video_frames": video_frames,
         "audio_samples": audio_frames,
     }
 
 
-def split_video_to_frames(video_filepath, fstart=None, fend=None, out_fps=25):
-    # src: https://github.com/kylemcdonald/python-utils/blob/master/ffmpeg.py
-    #NOTE: splitting video into frames is faster on CPU than GPU
-    width, height = get_video_resolution(video_filepath)
-    video_stream = ffmpeg.input(str(video_filepath)).video.filter("fps", fps=out_fps)
-    channels = 3
-    try:
+class FrameReader:
+    """
+    Reads the video frames resampled to `out_fps` (or only the frames in
+    [fstart, fend) of the resampled video) from a raw ffmpeg pipe. Frames are
+    read with `readinto` into a preallocated ring of `num_batches` buffers of
+    `batch_size` frames, so no memory is allocated per frame: the yielded
+    arrays are views into the ring that stay valid while the next
+    `(num_batches - 1) * batch_size` frames are read; copy them to keep them
+    longer. Segments further than `preroll_frames` from the start are read by
+    seeking the input to the keyframe before them, which yields the same
+    frames as decoding the video from the start. With `grayscale`, ffmpeg
+    decodes single-channel (H, W) frames instead of (H, W, 3) BGR ones.
+    `probe` is the `probe_video_stream()` result of the video, so that readers
+    of the same video don't run ffprobe again.
+    """
+
+    def __init__(
+        self,
+        video_filepath,
+        fstart=None,
+        fend=None,
+        out_fps=25,
+        preroll_frames=25,
+        batch_size=1,
+        num_batches=32,
+        grayscale=False,
+        probe=None,
+    ):
+        self.video_filepath = video_filepath
+        self.out_fps = out_fps
+        self.batch_size = batch_size
+        if probe is None:
+            with subprocess_slot():
+                probe = probe_video_stream(video_filepath)
+        stream, container = probe
+        self.height, self.width = int(stream["height"]), int(stream["width"])
+        self.pix_fmt, self.channels = ("gray", 1) if grayscale else ("bgr24", 3)
+        self.fstart, self.max_frames, self.seek_frame = 0, None, 0
         if fstart is not None and fend is not None:
-            process = (
-                video_stream.trim(start_frame=fstart, end_frame=fend)
-                .setpts("PTS-STARTPTS")
-                .output("pipe:", format="rawvideo", pix_fmt="bgr24")
-                .run_async(pipe_stdout=True, quiet=True)
-            )
-            frames_counter = 0
-            while frames_counter < fend - fstart:
-                in_bytes = process.stdout.read(width * height * channels)
-                in_frame = np.frombuffer(in_bytes, np.uint8).reshape(
-                    width, height, channels
+            self.fstart, self.max_frames = fstart, fend - fstart
+            self.seek_frame = max(0, fstart - preroll_frames)
+        if self.seek_frame > 0:
+            # align the seek position to the `out_fps` grid, which starts at the
+            # first video frame (not necessarily at the container start), and
+            # to the stream's time base so that frame timestamps shift exactly
+            self.first_frame = math.floor(
+                (
+                    float(stream.get("start_time", 0))
+                    - float(container.get("start_time", 0))
                 )
-                yield in_frame
-                frames_counter += 1
+                * out_fps
+                + 0.5
+            )
+            time_base = Fraction(stream.get("time_base", "1/90000"))
+            step = (Fraction(1, out_fps) / time_base).denominator
+            self.seek_frame = (
+                (self.first_frame + self.seek_frame) // step * step - self.first_frame
+            )
+        self.frame_shape = (self.height, self.width)
+        if not grayscale:
+            self.frame_shape += (self.channels,)
+        self.ring = np.empty(
+            (num_batches * batch_size, *self.frame_shape), dtype=np.uint8
+        )
+
+    def run_ffmpeg(self):
+        if self.seek_frame > 0:
+            video_stream = ffmpeg.input(
+                str(self.video_filepath),
+                ss=(self.first_frame + self.seek_frame) / self.out_fps,
+                threads=get_subprocess_threads(),
+            ).video.filter("fps", fps=self.out_fps, start_time=0)
         else:
-            process = (
-                video_stream.setpts("PTS-STARTPTS")
-                .output("pipe:", format="rawvideo", pix_fmt="bgr24")
-                .run_async(pipe_stdout=True, quiet=True)
+            video_stream = ffmpeg.input(
+                str(self.video_filepath), threads=get_subprocess_threads()
+            ).video.filter("fps", fps=self.out_fps)
+        if self.max_frames is not None:
+            video_stream = video_stream.trim(
+                start_frame=self.fstart - self.seek_frame,
+                end_frame=self.fstart + self.max_frames - self.seek_frame,
             )
-            while True:
-                in_bytes = process.stdout.read(width * height * channels)
-                if not in_bytes:
-                    break
-                in_frame = np.frombuffer(in_bytes, np.uint8).reshape(
-                    width, height, channels
-                )
-                yield in_frame
+        return (
+            video_stream.setpts("PTS-STARTPTS")
+            .output("pipe:", format="rawvideo", pix_fmt=self.pix_fmt)
+            .run_async(pipe_stdout=True, quiet=True)
+        )
 
-    finally:
-        process.stdout.close()
-        process.wait()
+    def get_timestamps(self, start_idx, num_frames):
+        """Seconds since the first video frame of the given frames"""
+        return (self.fstart + start_idx + np.arange(num_frames)) / self.out_fps
+
+    @staticmethod
+    def read_into(fin, buffer):
+        view = memoryview(buffer).cast("B")
+        num_bytes = 0
+        while num_bytes < len(view):
+            num_read = fin.readinto(view[num_bytes:])
+            if not num_read:
+                break
+            num_bytes += num_read
+        return num_bytes
+
+    def iter_batches(self):
+        """Yields (timestamps, frames) with frames of shape (B, H, W[, 3])"""
+        #NOTE: splitting video into frames is faster on CPU than GPU
+        frame_size = self.height * self.width * self.channels
+        with subprocess_slot():
+            process = self.run_ffmpeg()
+            try:
+                num_frames_read, slot = 0, 0
+                while self.max_frames is None or num_frames_read < self.max_frames:
+                    batch_size = self.batch_size
+                    if self.max_frames is not None:
+                        batch_size = min(batch_size, self.max_frames - num_frames_read)
+                    batch = self.ring[slot : slot + batch_size]
+                    num_frames = self.read_into(process.stdout, batch) // frame_size
+                    if num_frames == 0:
+                        break  # video ended
+                    timestamps = self.get_timestamps(num_frames_read, num_frames)
+                    yield timestamps, batch[:num_frames]
+                    num_frames_read += num_frames
+                    if num_frames < batch_size:
+                        break  # video ended
+                    slot = (slot + self.batch_size) % len(self.ring)
+            finally:
+                process.stdout.close()
+                process.wait()
+
+    def __iter__(self):
+        for _, batch in self.iter_batches():
+            yield from batch
+
+
+def split_video_to_frames(
+    video_filepath,
+    fstart=None,
+    fend=None,
+    out_fps=25,
+    preroll_frames=25,
+    grayscale=False,
+):
+    """
+    Yields the video frames as independent arrays (see `FrameReader` for
+    reading them without allocating memory per frame).
+    """
+    # src: https://github.com/kylemcdonald/python-utils/blob/master/ffmpeg.py
+    reader = FrameReader(
+        video_filepath,
+        fstart,
+        fend,
+        out_fps,
+        preroll_frames,
+        batch_size=32,
+        grayscale=grayscale,
+    )
+    for _, batch in reader.iter_batches():
+        # one allocation per batch, frames are views into it
+        yield from batch.copy()
+
+
+class FrameBuffer:
+    """Keeps the frames pushed to it in a (T, H, W[, 3]) array"""
+
+    def __init__(self, num_frames, frame_shape):
+        self.frames = np.empty((num_frames, *frame_shape), dtype=np.uint8)
+        self.num_pushed = 0
+
+    def push(self, frame):
+        self.frames[self.num_pushed] = frame
+        self.num_pushed += 1
+
+    def finish(self):
+        return self.frames[: self.num_pushed]
+
+
+def stream_video_segments(
+    video_filepath,
+    frame_ranges,
+    out_fps=25,
+    grayscale=False,
+    probe=None,
+    make_consumer=None,
+):
+    """
+    Decodes the video once and yields `(idx, result)` for every
+    `(fstart, fend)` in `frame_ranges` as soon as its last frame is decoded.
+    The frames of a range are pushed to `make_consumer(idx)` as they're
+    decoded and `result` is its `finish()`, e.g. a `PatchCropper` that only
+    keeps the mouth patches. By default, `result` is a (T, H, W, 3) array
+    of the frames, or (T, H, W) with `grayscale`.
+    """
+    order = sorted(range(len(frame_ranges)), key=lambda i: frame_ranges[i][0])
+    reader = FrameReader(
+        video_filepath,
+        out_fps=out_fps,
+        batch_size=32,
+        grayscale=grayscale,
+        probe=probe,
+    )
+    if make_consumer is None:
+        make_consumer = lambda idx: FrameBuffer(
+            frame_ranges[idx][1] - frame_ranges[idx][0], reader.frame_shape
+        )
+    active = {}  # range index -> consumer of the range's frames
+    next_i = 0
+    frame_idx = 0
+    for _, batch in reader.iter_batches():
+        for frame in batch:
+            # open the ranges starting at this frame
+            while next_i < len(order) and frame_ranges[order[next_i]][0] <= frame_idx:
+                active[order[next_i]] = make_consumer(order[next_i])
+                next_i += 1
+            for consumer in active.values():
+                consumer.push(frame)
+            frame_idx += 1
+            # hand over the ranges that are complete
+            for idx in [i for i in active if frame_ranges[i][1] <= frame_idx]:
+                yield idx, active.pop(idx).finish()
+        if next_i == len(order) and not active:
+            return  # no need to decode the rest of the video
+    # video ended before these ranges did
+    for idx in list(active):
+        yield idx, active.pop(idx).finish()
+    for idx in order[next_i:]:
+        yield idx, make_consumer(idx).finish()
 
 
 def save_video(frames, out_filepath, fps, vcodec="libx264"):
@@ -259,22 +557,34 @@ def save_video(frames, out_filepath, fps, vcodec="libx264"):
             " skipping!!" 
         )
         return
-    height, width, _ = frames[0].shape
-    process = (
-        ffmpeg.input(
-            "pipe:", format="rawvideo", pix_fmt="bgr24", s="{}x{}".format(width, height)
+    height, width = frames[0].shape[:2]
+    # single-channel frames are written as grayscale videos
+    pix_fmt = "gray" if frames[0].ndim == 2 else "bgr24"
+    with atomic_output(out_filepath) as tmp_filepath:
+        process = (
+            ffmpeg.input(
+                "pipe:", format="rawvideo", pix_fmt=pix_fmt, s="{}x{}".format(width, height)
+            )
+            .output(
+                str(tmp_filepath),
+                format=out_filepath.suffix[1:],
+                pix_fmt=pix_fmt,
+                vcodec=vcodec,
+                r=fps,
+                threads=get_subprocess_threads(),
+            )
+            .overwrite_output()
         )
-        .output(str(out_filepath), pix_fmt="bgr24", vcodec=vcodec, r=fps)
-        .overwrite_output()
-        .run_async(pipe_stdin=True, quiet=True)
-    )
-    for _, frame in enumerate(frames):
-        try:
-            process.stdin.write(frame.astype(np.uint8).tobytes())
-        except:
-            print(process.stderr.read())
-    process.stdin.close()
-    process.wait()
+        with subprocess_slot():
+            process = process.run_async(pipe_stdin=True, quiet=True)
+            for _, frame in enumerate(frames):
+                try:
+                    process.stdin.write(frame.astype(np.uint8).tobytes())
+                except:
+                    print(process.stderr.read())
+            process.stdin.close()
+            if process.wait() != 0:
+                raise ffmpeg.Error("ffmpeg", None, process.stderr.read())
 
 
 def load_video(filename):
@@ -336,6 +646,237 @@ def cut_patch(img, metadata, height, width, threshold=5):
     return cutted_img
 
 
+def interpolate_landmarks(landmarks, valid=None):
+    """
+    Fills the landmarks of frames without a detection by linear interpolation
+    between the surrounding detections, repeating the first/last detection at
+    the edges. `landmarks` is either a list with `None` for missing frames or
+    a (T, 68, 2) array whose missing frames are given by the `valid` mask (or
+    are NaN). Returns a (T, 68, 2) array, or None if nothing was detected.
+    """
+    if isinstance(landmarks, np.ndarray):
+        landmarks = landmarks.astype(np.float64)
+        if valid is None:
+            valid = ~np.isnan(landmarks).any(axis=(1, 2))
+    else:
+        if valid is None:
+            valid = [lnd is not None for lnd in landmarks]
+        shape = next((np.shape(lnd) for lnd in landmarks if lnd is not None), None)
+        if shape is None:
+            return None
+        landmarks = np.stack(
+            [
+                np.zeros(shape) if lnd is None else np.asarray(lnd, dtype=np.float64)
+                for lnd in landmarks
+            ]
+        )
+    valid = np.asarray(valid, dtype=bool)
+    if valid.all():
+        return landmarks
+    if not valid.any():
+        return None
+    # closest valid frame before & after every frame
+    num_frames = len(landmarks)
+    frame_idx = np.arange(num_frames)
+    prev_idx = np.maximum.accumulate(np.where(valid, frame_idx, -1))
+    next_idx = np.minimum.accumulate(np.where(valid, frame_idx, num_frames)[::-1])[::-1]
+    # -- Corner case: frames at the beginning or at the end failed to be detected.
+    prev_idx = np.where(prev_idx < 0, next_idx, prev_idx)
+    next_idx = np.where(next_idx == num_frames, prev_idx, next_idx)
+    span = next_idx - prev_idx
+    weight = np.where(span > 0, (frame_idx - prev_idx) / np.maximum(span, 1), 0.0)
+    return landmarks[prev_idx] + weight[:, None, None] * (
+        landmarks[next_idx] - landmarks[prev_idx]
+    )
+
+
+def smooth_landmarks(landmarks, window):
+    """
+    Moving average of (T, 68, 2) `landmarks` over `window` frames; the i-th
+    output is the mean of `landmarks[i : i + window]`.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    if len(landmarks) < window:
+        return np.empty((0, *landmarks.shape[1:]))
+    cumsum = np.cumsum(landmarks, axis=0)
+    cumsum = np.concatenate([np.zeros_like(cumsum[:1]), cumsum])
+    return (cumsum[window:] - cumsum[:-window]) / window
+
+
+def estimate_similarity_transforms(src, dst):
+    """
+    Batched version of `transform.estimate_transform("similarity", ...)`
+    (Umeyama's method) mapping every `src[i]` of shape (N, 2) onto `dst`.
+    Returns the forward transforms as (T, 2, 3) affine matrices.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    src_mean = src.mean(axis=1)
+    dst_mean = dst.mean(axis=0)
+    src_demean = src - src_mean[:, None]
+    dst_demean = dst - dst_mean
+    A = np.einsum("nj,tnk->tjk", dst_demean, src_demean) / src.shape[1]
+    d = np.ones((len(src), 2))
+    d[np.linalg.det(A) < 0, 1] = -1
+    U, S, V = np.linalg.svd(A)
+    rotation = U @ (d[:, :, None] * V)
+    scale = (S * d).sum(axis=1) / src_demean.var(axis=1).sum(axis=1)
+    rotation *= scale[:, None, None]
+    translation = dst_mean - np.einsum("tjk,tk->tj", rotation, src_mean)
+    return np.concatenate([rotation, translation[:, :, None]], axis=2)
+
+
+def get_patch_transforms(
+    transforms, patch_metadata, std_size, crop_height, crop_width
+):
+    """
+    Shifts the (T, 2, 3) `transforms` so that they map every frame straight
+    into the mouth window `cut_patch` would cut from the `std_size` image.
+    """
+    half_height, half_width = crop_height // 2, crop_width // 2
+    centers = (
+        np.einsum("tjk,tk->tj", transforms[:, :, :2], patch_metadata.mean(axis=1))
+        + transforms[:, :, 2]
+    )
+    # same clipping as `cut_patch`
+    center_x = np.clip(centers[:, 0], half_width, std_size[1] - half_width)
+    center_y = np.clip(centers[:, 1], half_height, std_size[0] - half_height)
+    patch_transforms = transforms.copy()
+    patch_transforms[:, 0, 2] -= np.round(center_x) - half_width
+    patch_transforms[:, 1, 2] -= np.round(center_y) - half_height
+    return patch_transforms
+
+
+def warp_patch(img, patch_transform, crop_height, crop_width):
+    return cv2.warpAffine(
+        img,
+        patch_transform,
+        (crop_width, crop_height),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+
+
+class PatchCropper:
+    """
+    Warps the frames of a segment into their mouth patch as they're pushed
+    one by one (e.g. while the video is decoded), holding only the last
+    `window_margin` full-size frames; `finish()` returns the patches. The
+    patches are the same as the ones of `crop_patch()`.
+    """
+
+    stablePntsIDs = [33, 36, 39, 42, 45]
+
+    def __init__(
+        self,
+        num_frames,
+        metadata,
+        mean_face_metadata,
+        std_size=(256, 256),
+        window_margin=12,
+        start_idx=48,
+        stop_idx=68,
+        crop_height=96,
+        crop_width=96,
+    ):
+        self.mean_face_metadata = mean_face_metadata
+        self.std_size = std_size
+        self.start_idx, self.stop_idx = start_idx, stop_idx
+        self.crop_height, self.crop_width = crop_height, crop_width
+        self.max_frames = len(metadata)
+        self.metadata = interpolate_landmarks(metadata)
+        self.q_frame = deque()
+        self.sequence = []
+        self.num_pushed = 0
+        if self.metadata is None:
+            # no face was detected in any frame
+            self.transforms = self.patch_transforms = None
+            return
+        self.margin = min(num_frames, window_margin)
+        # -- estimate the transformations of all frames at once
+        smoothed_metadata = smooth_landmarks(self.metadata, self.margin)
+        self.transforms = estimate_similarity_transforms(
+            smoothed_metadata[:, self.stablePntsIDs, :],
+            mean_face_metadata[self.stablePntsIDs, :],
+        )
+        self.patch_transforms = get_patch_transforms(
+            self.transforms,
+            self.metadata[: len(self.transforms), start_idx:stop_idx],
+            std_size,
+            crop_height,
+            crop_width,
+        )
+        self.max_frames = len(self.metadata)
+
+    def push(self, frame):
+        if self.num_pushed == self.max_frames:
+            return  # frames past the landmarks are dropped
+        self.num_pushed += 1
+        if self.patch_transforms is None:
+            size = (self.crop_width, self.crop_height)
+            self.sequence.extend(resize_frames([frame], size))
+            return
+        # -- warp every frame straight into its mouth patch
+        self.q_frame.append(frame)
+        if len(self.q_frame) == self.margin:
+            self.sequence.append(
+                warp_patch(
+                    self.q_frame.popleft(),
+                    self.patch_transforms[len(self.sequence)],
+                    self.crop_height,
+                    self.crop_width,
+                )
+            )
+
+    def finish(self):
+        q_frame, sequence = self.q_frame, self.sequence
+        if q_frame:
+            # -- the last frames reuse the last transformation
+            if sequence:
+                trans = self.transforms[len(sequence) - 1]
+            else:
+                # fewer frames than `margin`, smooth over the available ones
+                trans = estimate_similarity_transforms(
+                    self.metadata[None, : len(q_frame), self.stablePntsIDs, :].mean(
+                        axis=1
+                    ),
+                    self.mean_face_metadata[self.stablePntsIDs, :],
+                )[0]
+            tail_idx = len(sequence) + np.arange(len(q_frame))
+            tail_transforms = get_patch_transforms(
+                np.repeat(trans[None], len(q_frame), axis=0),
+                self.metadata[tail_idx, self.start_idx : self.stop_idx],
+                self.std_size,
+                self.crop_height,
+                self.crop_width,
+            )
+            for patch_transform in tail_transforms:
+                sequence.append(
+                    warp_patch(
+                        q_frame.popleft(),
+                        patch_transform,
+                        self.crop_height,
+                        self.crop_width,
+                    )
+                )
+        return sequence
+
+
+class FrameResizer:
+    """Resizes the frames of a segment as they're pushed (see `PatchCropper`)"""
+
+    def __init__(self, new_size):
+        self.new_size = new_size
+        self.sequence = []
+
+    def push(self, frame):
+        self.sequence.extend(resize_frames([frame], self.new_size))
+
+    def finish(self):
+        return self.sequence
+
+
 def crop_patch(
     video_frames,
     num_frames,
@@ -349,76 +890,26 @@ def crop_patch(
     crop_width=96,
 ):
     """Crop mouth patch"""
-    stablePntsIDs = [33, 36, 39, 42, 45]
-    margin = min(num_frames, window_margin)
-    q_frame, q_metadata = deque(), deque()
-    sequence = []
-    for frame_idx, frame in enumerate(video_frames):
-        if frame_idx >= len(metadata):
-            break  #! Sadly, this is necessary
-        q_metadata.append(metadata[frame_idx])
-        q_frame.append(frame)
-        if len(q_frame) == margin:
-            smoothed_metadata = np.mean(q_metadata, axis=0)
-            cur_metadata = q_metadata.popleft()
-            cur_frame = q_frame.popleft()
-            # -- affine transformation
-            trans_frame, trans = warp_img(
-                smoothed_metadata[stablePntsIDs, :],
-                mean_face_metadata[stablePntsIDs, :],
-                cur_frame,
-                std_size,
-            )
-            trans_metadata = trans(cur_metadata)
-            # -- crop mouth patch
-            sequence.append(
-                cut_patch(
-                    trans_frame,
-                    trans_metadata[start_idx:stop_idx],
-                    crop_height // 2,
-                    crop_width // 2,
-                )
-            )
-
-    while q_frame:
-        cur_frame = q_frame.popleft()
-        # -- transform frame
-        trans_frame = apply_transform(trans, cur_frame, std_size)
-        # -- transform metadata
-        trans_metadata = trans(q_metadata.popleft())
-        # -- crop mouth patch
-        sequence.append(
-            cut_patch(
-                trans_frame,
-                trans_metadata[start_idx:stop_idx],
-                crop_height // 2,
-                crop_width // 2,
-            )
-        )
-    return sequence
+    cropper = PatchCropper(
+        num_frames,
+        metadata,
+        mean_face_metadata,
+        std_size,
+        window_margin,
+        start_idx,
+        stop_idx,
+        crop_height,
+        crop_width,
+    )
+    for frame in islice(video_frames, cropper.max_frames):
+        cropper.push(frame)
+    return cropper.finish()
 
 
 def read_av_manifest(tsv_filepath):
-    with open(tsv_filepath) as fin:
-        res = []
-        for ln in fin.readlines()[1:]:
-            id_, video, audio, video_frames, audio_samples = ln.strip().split("\t")
-            res.append(
-                {
-                    "id": id_,
-                    "video": video,
-                    "audio": audio,
-                    "video_frames": video_frames,
-                    "audio_samples": audio_samples,
-                }
-            )
-    df = pd.DataFrame(res)
-    df["video_frames"] = df["video_frames"].astype(int)
-    df["audio_samples"] = df["audio_samples"].astype(int)
-    return df
+    # parsed once, later reads use the manifest's columnar index
+    return read_manifest(tsv_filepath)
 
 
 def write_av_manifest(df, out_filepath):
-    with open(out_filepath, "w") as fout:
-        fout.write("/\n")
-    df.to_csv(out_filepath, sep="\t", header=False, index=False, mode="a")
+    write_manifest(df, out_filepath)